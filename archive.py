@@ -0,0 +1,205 @@
+import heapq
+import os
+import threading
+from itertools import chain
+
+from sqlalchemy import bindparam, create_engine, event, text
+from sqlalchemy.pool import NullPool
+
+import database
+import fts
+
+
+# Catalog of the archived prescriptions, in the live database
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS archived (
+        id INTEGER PRIMARY KEY NOT NULL,
+        user_id INTEGER NOT NULL,
+        patient_id INTEGER,
+        year INTEGER NOT NULL,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )
+"""
+
+# Tables moved to the year files (column holding the prescription id)
+TABLES = {"prescriptions": "id", "patients": "prescription_id", "vitals": "prescription_id", "medications": "prescription_id"}
+
+# Indexes of the year files, same lookups as the live database
+INDEXES = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS archive.prescriptions_id ON prescriptions (id)",
+    "CREATE INDEX IF NOT EXISTS archive.prescriptions_visit ON prescriptions (user_id, visit_date, id)",
+    "CREATE INDEX IF NOT EXISTS archive.prescriptions_patient ON prescriptions (patient_id, visit_date)",
+    "CREATE INDEX IF NOT EXISTS archive.patients_prescription ON patients (prescription_id)",
+    "CREATE INDEX IF NOT EXISTS archive.vitals_prescription ON vitals (prescription_id)",
+    "CREATE INDEX IF NOT EXISTS archive.medications_prescription ON medications (prescription_id, sequence)",
+]
+
+# Connection settings worth having on a read-only file
+READ_PRAGMAS = ["busy_timeout", "mmap_size", "cache_size", "temp_store"]
+
+
+def path(folder, year):
+    return os.path.join(folder, f"prescriptions-{year}.db")
+
+
+def locate(conn, user_id, prescription_id):
+    """Get the archive year of a user's prescription, None if it isn't archived (or belongs to someone else)"""
+    return conn.execute(
+        text("SELECT year FROM archived WHERE id = :id AND user_id = :uid"), {"id": prescription_id, "uid": user_id}
+    ).scalar()
+
+
+def years(conn, user_id, start=None, end=None):
+    """Get the years a user has archived prescriptions in, optionally only those overlapping start..end (end exclusive)"""
+    found = conn.execute(text("SELECT DISTINCT year FROM archived WHERE user_id = :uid"), {"uid": user_id}).scalars().all()
+    return [year for year in found if (not start or year >= int(start[:4])) and (not end or f"{year}-01-01" < end)]
+
+
+def patient_years(conn, patient_id):
+    """Get the years a registry patient has archived visits in"""
+    return conn.execute(text("SELECT DISTINCT year FROM archived WHERE patient_id = :pid"), {"pid": patient_id}).scalars().all()
+
+
+class Archive:
+    """Read-only engines of the per-year archive files, each opened on first use"""
+
+    def __init__(self, folder, pragmas):
+        self.folder = folder
+        self.pragmas = {name: value for name, value in pragmas.items() if name in READ_PRAGMAS}
+        self.engines = {}
+        self.lock = threading.Lock()
+
+    def engine(self, year):
+        with self.lock:
+            if year not in self.engines:
+                engine = create_engine(f"sqlite:///file:{path(self.folder, year)}?mode=ro&uri=true", future=True)
+                database.tune(engine, self.pragmas)
+                self.engines[year] = engine
+            return self.engines[year]
+
+    def dispose(self, close=True):
+        """Drop the engines opened so far (close=False: forget their connections without closing them), reopened on use"""
+        with self.lock:
+            for engine in self.engines.values():
+                engine.dispose(close=close)
+            self.engines.clear()
+
+    def rows(self, year, query, params):
+        """Yield the rows of query run on a year's file, straight from the cursor"""
+        with self.engine(year).connect() as conn:
+            result = conn.execution_options(yield_per=200).execute(text(query), params)
+            for row in result.mappings():
+                yield dict(row)
+
+    def merge(self, rows, years, query, params, keys, descending=False):
+        """Merge live rows with those of query run on the given year files, everything sorted by keys
+
+        Sorted by visit date, the year files (disjoint date ranges) are read one after
+        the other, so a file is only opened once the rows of the newer ones are used up.
+        """
+        years = sorted(years, reverse=descending)
+        if keys[0] == "visit_date":
+            archived = [chain.from_iterable(self.rows(year, query, params) for year in years)]
+        else:
+            archived = [self.rows(year, query, params) for year in years]
+        return heapq.merge(rows, *archived, key=lambda row: tuple(row[key] for key in keys), reverse=descending)
+
+
+def _mover(engine, folder, year, pragmas):
+    # Engine whose connections attach the year file as "archive" before any transaction begins
+    # (ATTACH isn't allowed inside one), a fresh connection each time
+    mover = create_engine(engine.url, poolclass=NullPool, future=True)
+    database.tune(mover, pragmas)
+    database.transactions(mover)
+
+    @event.listens_for(mover, "connect")
+    def attach(dbapi_connection, connection_record):
+        dbapi_connection.execute("ATTACH DATABASE ? AS archive", (path(folder, year),))
+
+    return mover
+
+
+def _create(conn):
+    # The year file's tables, created with the live tables' columns (no constraints, the users aren't there)
+    for table in TABLES:
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS archive.{table} AS SELECT * FROM main.{table} WHERE 0"))
+    for statement in INDEXES:
+        conn.execute(text(statement))
+    if conn.execute(text("SELECT 1 FROM archive.sqlite_master WHERE name = 'search_index'")).first() is None:
+        conn.execute(text(fts.SCHEMA.replace("search_index", "archive.search_index", 1)))
+        conn.execute(text("INSERT INTO archive.search_index(search_index, rank) VALUES ('rank', :rank)"), {"rank": fts.RANK})
+
+
+def reindex(folder, year):
+    """Build a year file's search_index again with the current fts.SCHEMA"""
+    engine = create_engine(f"sqlite:///{path(folder, year)}", poolclass=NullPool, future=True)
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS search_index"))
+        conn.execute(text(fts.SCHEMA))
+        conn.execute(text("INSERT INTO search_index(search_index, rank) VALUES ('rank', :rank)"), {"rank": fts.RANK})
+        conn.execute(text(fts.INDEX_ROWS))
+    engine.dispose()
+
+
+def move(engine, folder, user_id, before, pragmas, batch_size=500, progress=None):
+    """Move a doctor's prescriptions with a visit date before `before` to the year files, returns the number moved
+
+    Oldest first, one year per batch. Each batch is copied to its year file, entered in the
+    catalog and deleted from the live database in one write transaction, so no edit can
+    commit between the copy and the delete (rows left in a year file by an older, interrupted
+    run are replaced). progress(moved) is called after every batch.
+    """
+    os.makedirs(folder, exist_ok=True)
+    movers = {}
+
+    ids = bindparam("ids", expanding=True)
+    moved = 0
+    while True:
+        # Year of the oldest prescription left to move
+        with engine.connect() as conn:
+            oldest = conn.execute(
+                text("SELECT MIN(visit_date) FROM prescriptions WHERE user_id = :uid AND visit_date < :before"),
+                {"uid": user_id, "before": before}
+            ).scalar()
+        if oldest is None:
+            break
+        year = int(oldest[:4])
+        if year not in movers:
+            movers[year] = _mover(engine, folder, year, pragmas)
+
+        def batch(conn):
+            # (selected again under the write lock, the year's rows only)
+            rows = conn.execute(
+                text("""SELECT id, patient_id FROM prescriptions WHERE user_id = :uid AND visit_date >= :start AND visit_date < :end
+                    ORDER BY visit_date, id LIMIT :limit"""),
+                {"uid": user_id, "start": f"{year}-01-01", "end": min(before, f"{year + 1}-01-01"), "limit": batch_size}
+            ).all()
+            if not rows:
+                return rows
+
+            _create(conn)
+            params = {"ids": [row.id for row in rows]}
+            for table, column in TABLES.items():
+                conn.execute(text(f"DELETE FROM archive.{table} WHERE {column} IN :ids").bindparams(ids), params)
+                conn.execute(text(f"INSERT INTO archive.{table} SELECT * FROM main.{table} WHERE {column} IN :ids").bindparams(ids), params)
+            columns = ", ".join(["rowid", "user_id"] + fts.COLUMNS)
+            conn.execute(text("DELETE FROM archive.search_index WHERE rowid IN :ids").bindparams(ids), params)
+            conn.execute(text(f"INSERT INTO archive.search_index({columns}) SELECT {columns} FROM main.search_index WHERE rowid IN :ids").bindparams(ids), params)
+
+            conn.execute(
+                text("INSERT OR REPLACE INTO archived(id, user_id, patient_id, year) VALUES (:id, :uid, :pid, :year)"),
+                [{"id": row.id, "uid": user_id, "pid": row.patient_id, "year": year} for row in rows]
+            )
+            # Children go by ON DELETE CASCADE, the search_index rows in one statement
+            conn.execute(text("DELETE FROM search_index WHERE rowid IN :ids").bindparams(ids), params)
+            conn.execute(text("DELETE FROM prescriptions WHERE id IN :ids").bindparams(ids), params)
+            return rows
+
+        rows = database.write(movers[year], batch)
+        moved += len(rows)
+        if rows and progress:
+            progress(moved)
+
+    for mover in movers.values():
+        mover.dispose()
+    return moved
@@ -0,0 +1,27 @@
+import hashlib
+import os
+
+
+# {path: (mtime, content hash)}
+_hashes = {}
+
+
+def fingerprint(folder, filename):
+    """Short content hash of a static file, recomputed when the file changes"""
+    path = os.path.join(folder, filename)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = _hashes.get(path)
+    if not cached or cached[0] != mtime:
+        with open(path, "rb") as file:
+            cached = (mtime, hashlib.sha256(file.read()).hexdigest()[:12])
+        _hashes[path] = cached
+    return cached[1]
+
+
+def version(folder):
+    """One hash over every static file, changes whenever any of them does"""
+    names = sorted(name for name in os.listdir(folder) if os.path.isfile(os.path.join(folder, name)))
+    return hashlib.sha256(" ".join(f"{name}:{fingerprint(folder, name)}" for name in names).encode()).hexdigest()[:12]
@@ -0,0 +1,161 @@
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter, OrderedDict
+from itertools import chain
+
+from sqlalchemy import text
+
+import archive
+
+
+# Suggestion types of the search page mapped to their base (name) type
+BASES = {
+    "patient_name": "patient_name",
+    "age": "patient_name",
+    "sex": "patient_name",
+    "med_name": "med_name",
+    "dose": "med_name",
+    "form": "med_name",
+}
+
+# Rough per entry overhead (tuple, dict slot, Counter entry) used for the memory cap
+ENTRY_BYTES = 120
+
+
+class PrefixIndex:
+    """Frequency-weighted prefix lookup of names over a sorted array of lowercase keys"""
+
+    def __init__(self):
+        self.keys = []      # sorted [(key, name)], a key for the full name and each later word
+        self.counts = Counter()
+        self.size = 0
+
+    def add(self, name, count=1):
+        if name not in self.counts:
+            lower = name.lower()
+            words = lower.split()
+            for i in range(len(words)):
+                insort(self.keys, (" ".join(words[i:]), name))
+            self.size += len(words) * (len(lower) + len(name) + ENTRY_BYTES)
+        self.counts[name] += count
+
+    def search(self, prefix, limit=10):
+        """Get the most used names having a word starting with prefix"""
+        prefix = " ".join(prefix.lower().split())
+        found = set()
+        i = bisect_left(self.keys, (prefix,))
+        while i < len(self.keys) and self.keys[i][0].startswith(prefix):
+            found.add(self.keys[i][1])
+            i += 1
+        found = [name for name in found if self.counts[name] > 0]
+        return sorted(found, key=lambda name: (-self.counts[name], name))[:limit]
+
+
+class UserIndex:
+    """All search page suggestions of one doctor"""
+
+    def __init__(self):
+        self.names = {"patient_name": PrefixIndex(), "med_name": PrefixIndex()}
+        # {base type: {lowercase name: {type: Counter(values)}}}
+        self.details = {"patient_name": {}, "med_name": {}}
+        self.loaded = time.monotonic()
+
+    @property
+    def size(self):
+        return sum(index.size for index in self.names.values()) + ENTRY_BYTES * sum(len(d) for d in self.details.values())
+
+    def add(self, base, name, details, count=1, name_count=None):
+        """Count a name with its details e.g. add("med_name", "Napa", {"dose": "500mg", "form": "Tab."})"""
+        if not name:
+            return
+        self.names[base].add(name, count if name_count is None else name_count)
+        types = self.details[base].setdefault(name.lower(), {})
+        for type, value in details.items():
+            types.setdefault(type, Counter())[value] += count
+
+    def suggest(self, type, value, limit=10):
+        """Get suggestions as [{type: value}, ...] like the /query endpoint returns"""
+        base = BASES[type]
+        # Names: prefix lookup
+        if type == base:
+            return [{type: name} for name in self.names[base].search(value, limit)]
+        # Details: most used values for the exact name
+        counts = self.details[base].get(value.strip().lower(), {}).get(type, Counter())
+        return [{type: detail} for detail, count in counts.most_common(limit) if count > 0]
+
+
+# Patient name/age/sex combinations of a doctor with their number of prescriptions
+PATIENTS = """
+    SELECT patient_name, age, sex, COUNT(*) AS count FROM prescriptions
+    JOIN patients ON prescriptions.id = patients.prescription_id
+    WHERE prescriptions.user_id = :uid GROUP BY patient_name, age, sex
+"""
+
+
+def load(conn, user_id, archives=None):
+    """Build a doctor's suggestion index from the database (archived patients too given the archive.Archive)"""
+    index = UserIndex()
+
+    rows = conn.execute(text(PATIENTS), {"uid": user_id}).mappings().all()
+    if archives:
+        rows = chain(rows, *(archives.rows(year, PATIENTS, {"uid": user_id}) for year in archive.years(conn, user_id)))
+    for row in rows:
+        index.add("patient_name", row["patient_name"], {"age": row["age"] or "", "sex": row["sex"] or ""}, row["count"])
+
+    # Medications come from the med_suggestions counts (a med's total is the sum of its form counts)
+    rows = conn.execute(
+        text("SELECT med_name, field, value, count FROM med_suggestions WHERE user_id = :uid AND field IN ('dose', 'form') AND count > 0"),
+        {"uid": user_id}
+    ).mappings().all()
+    for row in rows:
+        index.add("med_name", row["med_name"], {row["field"]: row["value"]}, row["count"], row["count"] if row["field"] == "form" else 0)
+    return index
+
+
+class Cache:
+    """Per-user UserIndex cache, lazily loaded and LRU evicted under a memory cap"""
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        # Other workers write too, reload after ttl seconds
+        self.ttl = ttl
+        self.indexes = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id, loader):
+        with self.lock:
+            index = self.indexes.get(user_id)
+            if index and time.monotonic() - index.loaded < self.ttl:
+                self.indexes.move_to_end(user_id)
+                return index
+
+        # Load outside the lock, a concurrent duplicate load is harmless
+        index = loader()
+        with self.lock:
+            self.indexes[user_id] = index
+            self.indexes.move_to_end(user_id)
+            self._evict()
+        return index
+
+    def record(self, user_id, patient, medications):
+        """Count a newly saved prescription into an already loaded index"""
+        with self.lock:
+            index = self.indexes.get(user_id)
+            if not index:
+                return
+            index.add("patient_name", patient["patient_name"], {"age": patient["age"] or "", "sex": patient["sex"] or ""})
+            for med in medications:
+                index.add("med_name", med["med_name"], {"dose": med["dose"] or "", "form": med["form"] or ""})
+            self._evict()
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.indexes.pop(user_id, None)
+
+    def _evict(self):
+        # Least recently used first, always keeping the newest
+        total = sum(index.size for index in self.indexes.values())
+        while total > self.max_bytes and len(self.indexes) > 1:
+            _, index = self.indexes.popitem(last=False)
+            total -= index.size
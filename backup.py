@@ -0,0 +1,85 @@
+import glob
+import os
+import sqlite3
+import time
+
+
+def backup(source, path, pages=100, sleep=0.01, progress=None):
+    """Copy the database of an open sqlite3 connection to path while it stays in use
+
+    The SQLite backup API copies `pages` pages per step and lets go of the database for
+    `sleep` seconds between steps, so a writer waits for one step at most. A write made
+    through another connection would restart the copy: in WAL mode a read transaction
+    pins one snapshot for the whole copy instead (writers go on appending to the WAL,
+    which can't be checkpointed past it meanwhile). The copy goes to path + ".tmp", is
+    integrity checked and only then renamed to path (left as .tmp if the check fails).
+    progress(copied, total) is called after every step.
+    Returns {"pages", "bytes", "seconds", "restarts", "integrity"}.
+    """
+    temp = path + ".tmp"
+    if os.path.exists(temp):
+        os.remove(temp)
+
+    state = {"remaining": None, "restarts": 0}
+
+    def step(status, remaining, total):
+        # Remaining pages going up again: the copy started over
+        if state["remaining"] is not None and remaining > state["remaining"]:
+            state["restarts"] += 1
+        state["remaining"] = remaining
+        if progress:
+            progress(total - remaining, total)
+        # The backup API itself only sleeps when the database is busy
+        if remaining:
+            time.sleep(sleep)
+
+    started = time.perf_counter()
+    wal = source.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    target = sqlite3.connect(temp)
+    try:
+        if wal:
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        try:
+            source.backup(target, pages=pages, progress=step, sleep=sleep)
+        finally:
+            if wal:
+                source.execute("COMMIT")
+        seconds = time.perf_counter() - started
+        page_count = target.execute("PRAGMA page_count").fetchone()[0]
+        page_size = target.execute("PRAGMA page_size").fetchone()[0]
+        integrity = [row[0] for row in target.execute("PRAGMA integrity_check")]
+    finally:
+        target.close()
+
+    if integrity == ["ok"]:
+        os.replace(temp, path)
+    return {
+        "pages": page_count,
+        "bytes": page_count * page_size,
+        "seconds": seconds,
+        "restarts": state["restarts"],
+        "integrity": integrity,
+    }
+
+
+def snapshot(engine, folder, keep=7, pages=100, sleep=0.01, progress=None):
+    """Back up the engine's database to a new timestamped file in folder, keeping the newest `keep` files
+
+    Returns (path, backup() result).
+    """
+    os.makedirs(folder, exist_ok=True)
+    name = os.path.splitext(os.path.basename(engine.url.database))[0]
+    path = os.path.join(folder, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.db")
+
+    connection = engine.raw_connection()
+    try:
+        result = backup(connection.driver_connection, path, pages, sleep, progress)
+    finally:
+        connection.close()
+
+    # Oldest first out (timestamped names sort by date)
+    if result["integrity"] == ["ok"] and keep:
+        for old in sorted(glob.glob(os.path.join(folder, f"{name}-*.db")))[:-keep]:
+            os.remove(old)
+    return path, result
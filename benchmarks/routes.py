@@ -0,0 +1,153 @@
+"""Latency, queries per request and peak memory of every route on a synthetic clinic
+
+    python -m benchmarks.routes --doctors 5 --prescriptions 2000 --requests 50 --output bench.json
+
+Fills a fresh database (benchmarks.workload), logs in as one doctor and drives each
+route through the Flask test client. The JSON report carries the git commit, so
+reports of different commits can be compared.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def scenarios(rng, sample):
+    """Route name: function(client) making one request"""
+    form = {
+        "patient-name": "Bench Patient", "age": "40", "sex": "male", "day": "1", "month": "1", "year": "2025",
+        "chief-complaints": "fever", "diagnosis": "viral fever",
+        "med_name[]": sample["med_names"][:3], "dose[]": ["500mg"] * 3, "form[]": ["Tab."] * 3,
+        "schedule[]": ["1+0+1"] * 3, "timing[]": ["after meal"] * 3, "duration[]": ["5 days"] * 3,
+    }
+
+    def index_get(client):
+        # Account data is only sent when not sent yet this session
+        with client.session_transaction() as session:
+            session["sent"] = False
+        return client.get("/")
+
+    return {
+        "index (GET)": index_get,
+        "med-data (full)": lambda client: client.get("/med-data"),
+        "med-data (delta)": lambda client: client.get(f"/med-data?since={sample['med_version']}"),
+        "index (POST, save)": lambda client: client.post("/", data=form),
+        "view": lambda client: client.get(f"/view?id={rng.choice(sample['ids'])}"),
+        "history (first page)": lambda client: client.get("/history"),
+        "history (stream all)": lambda client: client.get("/history?stream=1"),
+        "search (patient name)": lambda client: client.post("/search", data={"patient-name": rng.choice(sample["patient_names"]).split()[0]}),
+        "search (medication)": lambda client: client.post("/search", data={"med_name": rng.choice(sample["med_names"])[:4]}),
+        "query (patient name)": lambda client: client.get(f"/query?value={rng.choice(sample['patient_names'])[:2]}&type=patient_name"),
+        "query (dose)": lambda client: client.get(f"/query?value={rng.choice(sample['med_names'])}&type=dose"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--doctors", type=int, default=5)
+    parser.add_argument("--prescriptions", type=int, default=2000, help="prescriptions per doctor")
+    parser.add_argument("--medications", type=int, default=300, help="size of the medication vocabulary")
+    parser.add_argument("--requests", type=int, default=50, help="requests per route")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON report to this file (default stdout)")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="at-tibb-bench-")
+    # Point the app at fresh databases before importing it
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'prescriptions.db')}"
+    os.environ["SESSION_DATABASE"] = f"sqlite:///{os.path.join(directory, 'sessions.db')}"
+    from sqlalchemy import event, text
+    from app import app, engine
+    from benchmarks import workload
+    import suggestions
+
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        users = workload.generate(conn, args.doctors, args.prescriptions, args.medications, seed=args.seed)
+    generate_seconds = time.perf_counter() - started
+
+    # Count statements per request
+    queries = [0]
+    @event.listens_for(engine, "before_cursor_execute")
+    def count(conn, cursor, statement, parameters, context, executemany):
+        queries[0] += 1
+
+    # Benchmark the first doctor
+    user_id, username = next(iter(users.items()))
+    with engine.connect() as conn:
+        sample = {
+            "ids": conn.execute(text("SELECT id FROM prescriptions WHERE user_id = :uid"), {"uid": user_id}).scalars().all(),
+            "patient_names": conn.execute(text("SELECT DISTINCT patient_name FROM patients JOIN prescriptions ON prescriptions.id = patients.prescription_id WHERE user_id = :uid"), {"uid": user_id}).scalars().all(),
+            "med_names": conn.execute(text("SELECT DISTINCT med_name FROM med_suggestions WHERE user_id = :uid"), {"uid": user_id}).scalars().all(),
+            # (a client missing the last ten medData changes)
+            "med_version": max(0, suggestions.version(conn, user_id) - 10),
+        }
+
+    client = app.test_client()
+    client.post("/login", data={"username": username, "password": workload.PASSWORD})
+    rng = random.Random(args.seed)
+
+    report = {
+        "commit": commit(),
+        "python": sys.version.split()[0],
+        "workload": {"doctors": args.doctors, "prescriptions_per_doctor": args.prescriptions, "medications": args.medications, "seed": args.seed, "generate_seconds": round(generate_seconds, 2)},
+        "requests_per_route": args.requests,
+        "routes": {},
+    }
+    tracemalloc.start()
+    for name, request in scenarios(rng, sample).items():
+        latencies, counts, peaks, statuses = [], [], [], set()
+        for _ in range(args.requests):
+            queries[0] = 0
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            response = request(client)
+            # Consume (streamed) bodies chunk by chunk without keeping them
+            for _ in response.iter_encoded():
+                pass
+            response.close()
+            latencies.append((time.perf_counter() - start) * 1000)
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+            counts.append(queries[0])
+            statuses.add(response.status_code)
+        report["routes"][name] = {
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p95_ms": round(percentile(latencies, 95), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+            "queries_per_request": round(sum(counts) / len(counts), 2),
+            "peak_memory_kib": round(max(peaks) / 1024, 1),
+            "status_codes": sorted(statuses),
+        }
+    tracemalloc.stop()
+    engine.dispose()
+    shutil.rmtree(directory, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Read/write throughput of concurrent workers with and without the SQLite tuning profile
+
+    python -m benchmarks.sqlite_tuning --workers 4 --seconds 5
+
+Each worker process (like a gunicorn worker) owns its own engine and loops over a
+mix of prescription saves and prescription/history reads on a fresh database.
+Prints one JSON object with operations per second for each profile.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+
+import database
+import fts
+import migrations
+import repository
+
+
+# Profiles compared: plain pysqlite connections vs. database.PRAGMAS
+PROFILES = {
+    "default": {"foreign_keys": "ON"},
+    "tuned": database.PRAGMAS,
+}
+
+
+def connect(path, pragmas):
+    engine = create_engine(f"sqlite:///{path}", future=True)
+    database.tune(engine, pragmas)
+    return engine
+
+
+def save(conn, user_id):
+    """Same statements as a prescription save in index()"""
+    prescription_id = conn.execute(
+        text("INSERT INTO prescriptions(user_id, day, month, year) VALUES(:uid, 1, 1, 2024) RETURNING id"), {"uid": user_id}
+    ).scalar()
+    conn.execute(text("INSERT INTO patients(prescription_id, patient_name, age, sex) VALUES (:prid, 'Patient', '30', 'male')"), {"prid": prescription_id})
+    conn.execute(text("INSERT INTO vitals(prescription_id, chief_complaints, diagnosis) VALUES (:prid, 'fever', 'viral fever')"), {"prid": prescription_id})
+    medications = [
+        {"sequence": i, "med_name": f"Med {random.randint(1, 50)}", "dose": "500mg", "form": "Tab.", "schedule": "1+0+1", "timing": "after", "duration": "5d"}
+        for i in range(1, 4)
+    ]
+    repository.save_medications(conn, user_id, prescription_id, medications, stored=[])
+    fts.index(conn, prescription_id, prescription_id)
+    return prescription_id
+
+
+def seed(path, prescriptions):
+    engine = connect(path, database.PRAGMAS)
+    migrations.migrate(engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users(id, username, hash) VALUES (1, 'bench', '')"))
+        for _ in range(prescriptions):
+            save(conn, 1)
+    engine.dispose()
+
+
+def worker(path, pragmas, seconds, write_ratio, results):
+    engine = connect(path, pragmas)
+    counts = {"reads": 0, "writes": 0, "errors": 0}
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        try:
+            if random.random() < write_ratio:
+                with engine.begin() as conn:
+                    save(conn, 1)
+                counts["writes"] += 1
+            else:
+                with engine.connect() as conn:
+                    last = conn.execute(text("SELECT MAX(id) FROM prescriptions")).scalar()
+                    repository.load_many(conn, 1, random.sample(range(1, last + 1), 10))
+                    conn.execute(text("SELECT id, timestamp FROM prescriptions WHERE user_id = 1 ORDER BY timestamp DESC, id DESC LIMIT 50")).all()
+                counts["reads"] += 1
+        except Exception:
+            # e.g. database is locked
+            counts["errors"] += 1
+    results.put(counts)
+
+
+def run(profile, args):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        seed(path, args.prescriptions)
+        # A rollback journal database must not stay in WAL mode from seeding
+        if PROFILES[profile].get("journal_mode") != "WAL":
+            create_engine(f"sqlite:///{path}").connect().exec_driver_sql("PRAGMA journal_mode = DELETE").close()
+
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=worker, args=(path, PROFILES[profile], args.seconds, args.write_ratio, results))
+            for _ in range(args.workers)
+        ]
+        for process in processes:
+            process.start()
+        totals = {"reads": 0, "writes": 0, "errors": 0}
+        for _ in processes:
+            for key, value in results.get().items():
+                totals[key] += value
+        for process in processes:
+            process.join()
+
+    return {
+        "reads_per_second": round(totals["reads"] / args.seconds, 1),
+        "writes_per_second": round(totals["writes"] / args.seconds, 1),
+        "errors": totals["errors"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--prescriptions", type=int, default=2000, help="rows seeded before the run")
+    args = parser.parse_args()
+
+    report = {"workers": args.workers, "seconds": args.seconds, "write_ratio": args.write_ratio}
+    for profile in PROFILES:
+        report[profile] = run(profile, args)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
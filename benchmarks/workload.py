@@ -0,0 +1,91 @@
+"""Synthetic clinic data: doctors with skewed medication use and returning patients"""
+import random
+
+from sqlalchemy import text
+from werkzeug.security import generate_password_hash
+
+import fts
+import registry
+import stats
+import suggestions
+from helpers import visit_date
+
+
+PASSWORD = "bench"
+
+FIRST_NAMES = ["Ali", "Fatima", "Rahim", "Karim", "Ayesha", "Nusrat", "Hasan", "Jamal", "Sadia", "Tania", "Rafiq", "Mitu"]
+LAST_NAMES = ["Khan", "Rahman", "Hossain", "Ahmed", "Islam", "Begum", "Chowdhury", "Sarkar", "Akter", "Uddin"]
+FORMS = ["Tab.", "Cap.", "Syp.", "Inj.", "Susp."]
+DOSES = ["5mg", "10mg", "20mg", "50mg", "250mg", "500mg", "650mg", "1g"]
+SCHEDULES = ["1+0+1", "1+1+1", "0+0+1", "1+0+0", "0+1+0"]
+TIMINGS = ["after meal", "before meal", "empty stomach"]
+DURATIONS = ["3 days", "5 days", "7 days", "14 days", "1 month", "continue"]
+COMPLAINTS = ["fever", "cough", "headache", "chest pain", "abdominal pain", "vomiting", "joint pain", "breathlessness"]
+DIAGNOSES = ["viral fever", "URTI", "HTN", "DM", "gastritis", "migraine", "asthma", "osteoarthritis"]
+
+
+def zipf_weights(n, s=1.1):
+    """Weights of a Zipf distribution, a few items are used most of the time"""
+    return [1 / (rank ** s) for rank in range(1, n + 1)]
+
+
+def generate(conn, doctors=5, prescriptions=1000, medications=300, patients=None, seed=1):
+    """Fill a fresh database with doctors * prescriptions prescriptions, returns {user_id: username}"""
+    rng = random.Random(seed)
+    # Same vocabulary for everyone, each doctor with their own favourites
+    vocabulary = [f"{rng.choice(['Napa', 'Seclo', 'Losec', 'Amlo', 'Metfo', 'Ceftri', 'Azi', 'Mont'])}-{i}" for i in range(medications)]
+    patients = patients or max(1, prescriptions // 3)
+    doctor_hash = generate_password_hash(PASSWORD, method="pbkdf2:sha256:1000")
+
+    users = {}
+    next_id = (conn.execute(text("SELECT MAX(id) FROM prescriptions")).scalar() or 0) + 1
+    for number in range(doctors):
+        username = f"doctor{number + 1}"
+        user_id = conn.execute(text("INSERT INTO users(username, hash) VALUES (:name, :hash) RETURNING id"), {"name": username, "hash": doctor_hash}).scalar()
+        conn.execute(text("INSERT INTO doctors(user_id, doctor_name) VALUES (:uid, :name)"), {"uid": user_id, "name": f"Dr. {username}"})
+        conn.execute(text("INSERT INTO clinics(user_id, clinic_name) VALUES (:uid, 'Clinic')"), {"uid": user_id})
+        users[user_id] = username
+
+        favourites = rng.sample(vocabulary, len(vocabulary))
+        med_weights = zipf_weights(len(favourites))
+        people = [(f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}", str(rng.randint(1, 90)), rng.choice(["male", "female"])) for _ in range(patients)]
+        people_weights = zipf_weights(len(people), 0.8)
+
+        rows = {"prescriptions": [], "patients": [], "vitals": [], "medications": []}
+        for _ in range(prescriptions):
+            prescription_id = next_id
+            next_id += 1
+            year, month, day = rng.randint(2015, 2025), rng.randint(1, 12), rng.randint(1, 28)
+            rows["prescriptions"].append({
+                "id": prescription_id, "uid": user_id, "ts": f"{year}-{month:02}-{day:02} 10:00:00", "day": day, "month": month, "year": year,
+                "visit": visit_date(day, month, year)
+            })
+            name, age, sex = rng.choices(people, people_weights)[0]
+            rows["patients"].append({"prid": prescription_id, "patient_name": name, "age": age, "sex": sex})
+            rows["vitals"].append({"prid": prescription_id, "chief": ", ".join(rng.sample(COMPLAINTS, 2)), "diag": rng.choice(DIAGNOSES)})
+            for sequence, med_name in enumerate(dict.fromkeys(rng.choices(favourites, med_weights, k=rng.randint(1, 6))), start=1):
+                rows["medications"].append({
+                    "prid": prescription_id, "seq": sequence, "name": med_name, "dose": rng.choice(DOSES), "form": rng.choice(FORMS),
+                    "schedule": rng.choice(SCHEDULES), "timing": rng.choice(TIMINGS), "duration": rng.choice(DURATIONS), "uid": user_id
+                })
+
+        conn.execute(text("INSERT INTO prescriptions(id, user_id, timestamp, day, month, year, visit_date) VALUES (:id, :uid, :ts, :day, :month, :year, :visit)"), rows["prescriptions"])
+        conn.execute(text("INSERT INTO patients(prescription_id, patient_name, age, sex) VALUES (:prid, :patient_name, :age, :sex)"), rows["patients"])
+        conn.execute(text("INSERT INTO vitals(prescription_id, chief_complaints, diagnosis) VALUES (:prid, :chief, :diag)"), rows["vitals"])
+        conn.execute(
+            text("""INSERT INTO medications(prescription_id, sequence, med_name, dose, form, schedule, timing, duration, user_id)
+                VALUES (:prid, :seq, :name, :dose, :form, :schedule, :timing, :duration, :uid)"""),
+            rows["medications"]
+        )
+        registry.link(conn, user_id, rows["patients"])
+
+    # Derived data in bulk, as an import would leave it
+    fts.index(conn)
+    suggestions.rebuild(conn)
+    stats.rebuild(conn)
+    # medData versions in the order the medications were last prescribed, so a
+    # client a few versions behind gets a delta of the latest ones
+    conn.execute(text("""INSERT INTO med_versions(user_id, med_name, version)
+        SELECT user_id, med_name, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY MAX(prescription_id)) FROM medications
+        GROUP BY user_id, med_name"""))
+    return users
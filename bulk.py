@@ -0,0 +1,231 @@
+import csv
+import json
+import time
+import zlib
+from datetime import date, datetime, timedelta
+from itertools import groupby, islice
+
+from sqlalchemy import text
+
+import archive
+import database
+import fts
+import registry
+import repository
+import stats
+import suggestions
+from helpers import norm, visit_date
+
+
+# A prescription record (JSONL: one per line, nested like this)
+#   {"username": ..., "timestamp": ..., "day": ..., "month": ..., "year": ...,
+#    "patient": {"patient_name": ..., "age": ..., "sex": ...},
+#    "vitals": {"chief_complaints": ..., "on_examination": ..., "test_advised": ..., "diagnosis": ...},
+#    "medications": [{"sequence": 1, "med_name": ..., "dose": ..., "form": ..., "schedule": ..., "timing": ..., "duration": ...}, ...]}
+PATIENT = ["patient_name", "age", "sex"]
+VITALS = ["chief_complaints", "on_examination", "test_advised", "diagnosis"]
+MEDICATION = ["sequence", "med_name", "dose", "form", "schedule", "timing", "duration"]
+
+# CSV: one row per medication, consecutive rows with the same ref are one prescription
+CSV_COLUMNS = ["ref", "username", "timestamp", "day", "month", "year"] + PATIENT + VITALS + MEDICATION
+
+# Export formats: mimetype
+FORMATS = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+
+def read_jsonl(file):
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_csv(file):
+    for _, rows in groupby(csv.DictReader(file), key=lambda row: row["ref"]):
+        rows = list(rows)
+        first = rows[0]
+        yield {
+            "username": first.get("username"),
+            "timestamp": first.get("timestamp"),
+            "day": first.get("day"),
+            "month": first.get("month"),
+            "year": first.get("year"),
+            "patient": {key: first.get(key) for key in PATIENT},
+            "vitals": {key: first.get(key) for key in VITALS},
+            "medications": [{key: row.get(key) for key in MEDICATION} for row in rows if row.get("med_name")],
+        }
+
+
+def read(file, format):
+    """Iterate over the prescription records of a csv or jsonl file"""
+    return read_csv(file) if format == "csv" else read_jsonl(file)
+
+
+def import_records(engine, records, username=None, batch_size=1000, progress=None):
+    """Insert prescription records in batched transactions, returns the number imported
+
+    Each batch is one write transaction of executemany INSERTs. The full-text
+    index rows of the batch are built in one statement after them, and patient registry links, medData suggestion counts and statistics are added in
+    one batch per transaction.
+    progress(count, seconds) is called after every batch.
+    """
+    users = {}
+    imported = 0
+    started = time.perf_counter()
+    records = iter(records)
+
+    while batch := list(islice(records, batch_size)):
+        # Holding the write lock from the start, the ids are numbered from MAX(id)
+        def insert_batch(conn):
+            # (PostgreSQL: no new rows from the id sequence until the batch is in and the sequence moved past it)
+            if conn.dialect.name == "postgresql":
+                conn.execute(text("LOCK TABLE prescriptions IN SHARE ROW EXCLUSIVE MODE"))
+            # (archived ids included, they stay taken, and so does every id the sequence handed out,
+            # even of deleted rows: cached renderings are keyed by prescription id)
+            next_id = max(
+                conn.execute(text("SELECT MAX(id) FROM (SELECT MAX(id) AS id FROM prescriptions UNION ALL SELECT MAX(id) FROM archived) AS ids")).scalar() or 0,
+                _last_id(conn)
+            ) + 1
+            first_id = next_id
+
+            rows = {"prescriptions": [], "patients": [], "vitals": [], "medications": []}
+            user_meds = {}
+            user_stats = {}
+            user_patients = {}
+            # Prescriptions without a timestamp are dated now (UTC, like CURRENT_TIMESTAMP)
+            now = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+            for record in batch:
+                name = username or record.get("username")
+                if name not in users:
+                    users[name] = conn.execute(text("SELECT id FROM users WHERE username = :name"), {"name": name}).scalar()
+                    if users[name] is None:
+                        raise ValueError(f"Unknown username: {name!r}")
+                user_id = users[name]
+
+                timestamp = record.get("timestamp")
+                if timestamp:
+                    try:
+                        datetime.strptime(str(timestamp), "%Y-%m-%d %H:%M:%S")
+                    except ValueError:
+                        raise ValueError(f"Invalid timestamp (expected 'YYYY-MM-DD HH:MM:SS'): {timestamp!r}")
+
+                prescription_id = next_id
+                next_id += 1
+                rows["prescriptions"].append({
+                    "id": prescription_id, "uid": user_id, "ts": timestamp or now,
+                    "day": norm(str(record.get("day") or "")) or None,
+                    "month": norm(str(record.get("month") or "")) or None,
+                    "year": norm(str(record.get("year") or "")) or None,
+                })
+                prescription = rows["prescriptions"][-1]
+                prescription["visit"] = visit_date(prescription["day"], prescription["month"], prescription["year"], prescription["ts"])
+                patient = record.get("patient") or {}
+                rows["patients"].append({"prid": prescription_id, **{key: patient.get(key) for key in PATIENT}})
+                user_patients.setdefault(user_id, []).append(rows["patients"][-1])
+                vitals = record.get("vitals") or {}
+                rows["vitals"].append({"prid": prescription_id, **{key: vitals.get(key) for key in VITALS}})
+                medications = [med for med in record.get("medications") or [] if med.get("med_name")]
+                for sequence, med in enumerate(medications, start=1):
+                    rows["medications"].append({"prid": prescription_id, "uid": user_id, **{key: med.get(key) for key in MEDICATION}, "sequence": sequence})
+                user_meds.setdefault(user_id, []).extend(medications)
+                user_stats.setdefault(user_id, []).append((prescription["visit"][:7], medications, vitals))
+
+            # Bulk insert, search_index rows of the batch built afterwards in one go
+            conn.execute(text("INSERT INTO prescriptions(id, user_id, timestamp, day, month, year, visit_date) VALUES (:id, :uid, :ts, :day, :month, :year, :visit)"), rows["prescriptions"])
+            conn.execute(text("INSERT INTO patients(prescription_id, patient_name, age, sex) VALUES (:prid, :patient_name, :age, :sex)"), rows["patients"])
+            conn.execute(text("INSERT INTO vitals(prescription_id, chief_complaints, on_examination, test_advised, diagnosis) VALUES (:prid, :chief_complaints, :on_examination, :test_advised, :diagnosis)"), rows["vitals"])
+            if rows["medications"]:
+                conn.execute(
+                    text("""INSERT INTO medications(prescription_id, sequence, med_name, dose, form, schedule, timing, duration, user_id)
+                        VALUES (:prid, :sequence, :med_name, :dose, :form, :schedule, :timing, :duration, :uid)"""),
+                    rows["medications"]
+                )
+            fts.index(conn, first_id, next_id - 1)
+            # Sequence moved past the batch
+            if conn.dialect.name == "postgresql":
+                conn.execute(text("SELECT setval(pg_get_serial_sequence('prescriptions', 'id'), :last)"), {"last": next_id - 1})
+            else:
+                conn.execute(text("UPDATE sqlite_sequence SET seq = :last WHERE name = 'prescriptions' AND seq < :last"), {"last": next_id - 1})
+
+            # Derived data in bulk
+            for user_id, medications in user_meds.items():
+                registry.link(conn, user_id, user_patients[user_id])
+                suggestions.record(conn, user_id, medications)
+                stats.record(conn, user_id, user_stats[user_id])
+            conn.execute(text("UPDATE users SET data_version = data_version + 1 WHERE id = :uid"), [{"uid": user_id} for user_id in user_meds])
+
+        database.write(engine, insert_batch)
+
+        imported += len(batch)
+        if progress:
+            progress(imported, time.perf_counter() - started)
+    return imported
+
+
+def _last_id(conn):
+    # Last prescription id handed out by the AUTOINCREMENT (serial) sequence, 0 if none yet
+    if conn.dialect.name == "postgresql":
+        return conn.execute(text("SELECT pg_sequence_last_value(pg_get_serial_sequence('prescriptions', 'id'))")).scalar() or 0
+    return conn.execute(text("SELECT seq FROM sqlite_sequence WHERE name = 'prescriptions'")).scalar() or 0
+
+
+def date_range(start=None, end=None):
+    """Bounds of the dates start..end (inclusive, 'YYYY-MM-DD') as start and exclusive end, ValueError if invalid"""
+    start = date.fromisoformat(start).isoformat() if start else None
+    end = (date.fromisoformat(end) + timedelta(days=1)).isoformat() if end else None
+    return start, end
+
+
+def _to_record(prescription, username):
+    # Same shape the import reads
+    return {
+        "id": prescription.prescription["id"],
+        "username": username,
+        **{key: prescription.prescription[key] for key in ["timestamp", "day", "month", "year"]},
+        "patient": {key: prescription.patient.get(key) for key in PATIENT},
+        "vitals": {key: prescription.vital.get(key) for key in VITALS},
+        "medications": [{key: med.get(key) for key in MEDICATION} for med in prescription.medications],
+    }
+
+
+class _Line:
+    # csv.writer target returning the written line instead of storing it
+    def write(self, line):
+        return line
+
+
+def _stream(conn, user_id, start, end, archives):
+    # Archived years first (oldest first), then the live database
+    if archives:
+        for year in sorted(archive.years(conn, user_id, start, end)):
+            with archives.engine(year).connect() as archived:
+                yield from repository.stream(archived, user_id, start, end)
+    yield from repository.stream(conn, user_id, start, end)
+
+
+def export(conn, user_id, format, start=None, end=None, archives=None):
+    """Yield a user's prescriptions as CSV or JSONL text, one chunk per prescription (archived ones too given the archive.Archive)"""
+    username = conn.execute(text("SELECT username FROM users WHERE id = :uid"), {"uid": user_id}).scalar()
+    records = (_to_record(prescription, username) for prescription in _stream(conn, user_id, start, end, archives))
+
+    if format == "jsonl":
+        for record in records:
+            yield json.dumps(record, ensure_ascii=False) + "\n"
+        return
+
+    writer = csv.writer(_Line())
+    yield writer.writerow(CSV_COLUMNS)
+    for record in records:
+        head = [record["id"], record["username"], record["timestamp"], record["day"], record["month"], record["year"]]
+        head += [record["patient"][key] for key in PATIENT] + [record["vitals"][key] for key in VITALS]
+        # A prescription without medications still gets its row
+        yield "".join(writer.writerow(head + [med[key] for key in MEDICATION]) for med in record["medications"] or [dict.fromkeys(MEDICATION)])
+
+
+def gzip_chunks(chunks, level=6):
+    """Gzip a stream of text chunks on the fly"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31) # wbits 31: gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,122 @@
+import random
+import threading
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+
+
+# SQLite tuning profile applied to every new connection (PRAGMA name: value)
+PRAGMAS = {
+    "journal_mode": "WAL",          # readers don't block the writer (and the other way round)
+    "synchronous": "NORMAL",        # safe with WAL, fsync only at checkpoints
+    "busy_timeout": 5000,           # wait up to 5 seconds for a lock
+    "foreign_keys": "ON",           # ON DELETE CASCADE of prescription rows
+    "mmap_size": 256 * 1024 * 1024, # read pages through memory mapping
+    "cache_size": -32000,           # 32 MB page cache per connection (negative = KiB)
+    "temp_store": "MEMORY",         # sorts and temp b-trees in memory
+}
+
+
+def tune(engine, pragmas):
+    """Apply a PRAGMA profile to each connection the engine opens"""
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+
+def create(url, pragmas, pool_size=5, max_overflow=10, pool_timeout=30, pool_recycle=1800, factory=None):
+    """Engine of a database URL with a connection pool of pool_size (+ max_overflow) connections
+
+    SQLite connections get the PRAGMA profile and BEGIN IMMEDIATE writes (factory: sqlite3
+    connection class); server databases (PostgreSQL) recycle connections after pool_recycle
+    seconds and ping them before use.
+    """
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite":
+        engine = create_engine(
+            url, future=True, pool_size=pool_size, max_overflow=max_overflow, pool_timeout=pool_timeout,
+            connect_args={"factory": factory} if factory else {}
+        )
+        tune(engine, pragmas)
+        transactions(engine)
+    else:
+        engine = create_engine(
+            url, future=True, pool_size=pool_size, max_overflow=max_overflow, pool_timeout=pool_timeout,
+            pool_recycle=pool_recycle, pool_pre_ping=True
+        )
+    return engine
+
+
+# Write lock contention of this process, see write()
+CONTENTION = {"writes": 0, "retries": 0, "failures": 0, "wait_seconds": 0.0}
+_contention_lock = threading.Lock()
+
+
+def transactions(engine):
+    """Let SQLAlchemy emit BEGIN itself: BEGIN IMMEDIATE on connections with execution option immediate=True
+
+    (pysqlite would otherwise begin lazily, at the first write, as a deferred transaction)
+    """
+
+    @event.listens_for(engine, "connect")
+    def disable_pysqlite_begin(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def begin(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE" if conn.get_execution_options().get("immediate") else "BEGIN")
+
+
+# PostgreSQL errors worth retrying: serialization failure, deadlock detected
+RETRY_PGCODES = {"40001", "40P01"}
+
+
+def _locked(error):
+    # (psycopg2 names the SQLSTATE pgcode, psycopg 3 sqlstate)
+    code = getattr(error.orig, "pgcode", None) or getattr(error.orig, "sqlstate", None)
+    if code:
+        return code in RETRY_PGCODES
+    return "database is locked" in str(error.orig) or "database is busy" in str(error.orig)
+
+
+def write(engine, work, deadline=10.0):
+    """Run work(conn) in a transaction holding the write lock from the start, returns its result
+
+    A deferred transaction that reads first and then writes can fail with "database is locked"
+    without waiting (another connection wrote in between); BEGIN IMMEDIATE waits for the lock
+    (busy_timeout) before anything is read. If it is still locked, retry with jittered
+    exponential backoff until deadline seconds have passed. work must be safe to run again.
+    On PostgreSQL (row locks, no database wide write lock) deadlocks and serialization
+    failures are retried the same way.
+    """
+    started = time.monotonic()
+    delay = 0.02
+    retries = 0
+    while True:
+        try:
+            with engine.connect() as conn:
+                conn.execution_options(immediate=True)
+                with conn.begin():
+                    result = work(conn)
+            break
+        except OperationalError as error:
+            if not _locked(error) or time.monotonic() - started + delay > deadline:
+                with _contention_lock:
+                    CONTENTION["failures"] += 1
+                    CONTENTION["wait_seconds"] += time.monotonic() - started
+                raise
+            time.sleep(delay * random.uniform(0.5, 1.5))
+            delay = min(delay * 2, 1.0)
+            retries += 1
+
+    with _contention_lock:
+        CONTENTION["writes"] += 1
+        CONTENTION["retries"] += retries
+        CONTENTION["wait_seconds"] += time.monotonic() - started if retries else 0.0
+    return result
@@ -0,0 +1,41 @@
+import threading
+from collections import OrderedDict
+
+
+class Cache:
+    """Rendered HTML fragments by key, valid while their version matches, LRU evicted under a memory cap"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.fragments = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, version, render):
+        """The cached fragment of key at version, else render() it and keep it"""
+        with self.lock:
+            entry = self.fragments.get(key)
+            if entry and entry[0] == version:
+                self.fragments.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # Render outside the lock, a concurrent duplicate render is harmless
+        html = render()
+        with self.lock:
+            old = self.fragments.pop(key, None)
+            if old:
+                self.size -= len(old[1])
+            self.fragments[key] = (version, html)
+            self.size += len(html)
+            self._evict()
+        return html
+
+    def _evict(self):
+        # Least recently used first
+        while self.size > self.max_bytes and self.fragments:
+            _, (_, html) = self.fragments.popitem(last=False)
+            self.size -= len(html)
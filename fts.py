@@ -0,0 +1,125 @@
+import re
+
+from sqlalchemy import text
+
+
+# Searchable text columns (rowid of search_index = prescription id, user_id indexed too so MATCH
+# only looks at the doctor's own rows)
+COLUMNS = ["patient_name", "med_name", "form", "dose", "chief_complaints", "diagnosis"]
+
+SCHEMA = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        patient_name, med_name, form, dose, chief_complaints, diagnosis,
+        user_id,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+"""
+
+# bm25 weights of the columns, the user_id term of every MATCH left out of the rank
+RANK = "bm25(1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 0.0)"
+
+# Index the text of prescriptions (filtered by a WHERE appended to it)
+INDEX_ROWS = """
+    INSERT INTO search_index(rowid, user_id, patient_name, med_name, form, dose, chief_complaints, diagnosis)
+    SELECT prescriptions.id, prescriptions.user_id,
+        (SELECT group_concat(patient_name, ' ') FROM patients WHERE prescription_id = prescriptions.id),
+        (SELECT group_concat(med_name, ' ') FROM medications WHERE prescription_id = prescriptions.id),
+        (SELECT group_concat(form, ' ') FROM medications WHERE prescription_id = prescriptions.id),
+        (SELECT group_concat(dose, ' ') FROM medications WHERE prescription_id = prescriptions.id),
+        (SELECT group_concat(chief_complaints, ' ') FROM vitals WHERE prescription_id = prescriptions.id),
+        (SELECT group_concat(diagnosis, ' ') FROM vitals WHERE prescription_id = prescriptions.id)
+    FROM prescriptions
+"""
+
+# PostgreSQL: a tsvector per searchable column ('simple' configuration: lowercased words, no stemming)
+POSTGRES_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS search_index (
+        prescription_id INTEGER PRIMARY KEY REFERENCES prescriptions(id) ON DELETE CASCADE,
+        user_id INTEGER NOT NULL,
+        patient_name TSVECTOR, med_name TSVECTOR, form TSVECTOR, dose TSVECTOR, chief_complaints TSVECTOR, diagnosis TSVECTOR
+    )""",
+] + [f"CREATE INDEX IF NOT EXISTS search_index_{column} ON search_index USING GIN ({column})" for column in COLUMNS]
+
+POSTGRES_INDEX_ROWS = """
+    INSERT INTO search_index(prescription_id, user_id, patient_name, med_name, form, dose, chief_complaints, diagnosis)
+    SELECT prescriptions.id, prescriptions.user_id,
+        to_tsvector('simple', COALESCE((SELECT string_agg(patient_name, ' ') FROM patients WHERE prescription_id = prescriptions.id), '')),
+        to_tsvector('simple', COALESCE((SELECT string_agg(med_name, ' ') FROM medications WHERE prescription_id = prescriptions.id), '')),
+        to_tsvector('simple', COALESCE((SELECT string_agg(form, ' ') FROM medications WHERE prescription_id = prescriptions.id), '')),
+        to_tsvector('simple', COALESCE((SELECT string_agg(dose, ' ') FROM medications WHERE prescription_id = prescriptions.id), '')),
+        to_tsvector('simple', COALESCE((SELECT string_agg(chief_complaints, ' ') FROM vitals WHERE prescription_id = prescriptions.id), '')),
+        to_tsvector('simple', COALESCE((SELECT string_agg(diagnosis, ' ') FROM vitals WHERE prescription_id = prescriptions.id), ''))
+    FROM prescriptions
+"""
+
+def index(conn, first_id=None, last_id=None):
+    """(Re)index all prescriptions, or those with first_id <= id <= last_id
+
+    Writers call this once their rows are in, in the same transaction (a saved or
+    edited prescription, a bulk import batch), there are no per row triggers.
+    """
+    key, rows = ("prescription_id", POSTGRES_INDEX_ROWS) if conn.dialect.name == "postgresql" else ("rowid", INDEX_ROWS)
+    if first_id is None:
+        conn.execute(text("DELETE FROM search_index"))
+        conn.execute(text(rows))
+    else:
+        params = {"first": first_id, "last": last_id}
+        conn.execute(text(f"DELETE FROM search_index WHERE {key} BETWEEN :first AND :last"), params)
+        conn.execute(text(rows + " WHERE prescriptions.id BETWEEN :first AND :last"), params)
+
+
+def create(conn):
+    """Create search_index and index every existing prescription"""
+    if conn.dialect.name == "postgresql":
+        for statement in POSTGRES_SCHEMA:
+            conn.execute(text(statement))
+    else:
+        conn.execute(text(SCHEMA))
+        conn.execute(text("INSERT INTO search_index(search_index, rank) VALUES ('rank', :rank)"), {"rank": RANK})
+    index(conn)
+
+
+def _words(value):
+    # Same word splitting as the unicode61 tokenizer
+    return re.findall(r"[^\W_]+", value or "")
+
+
+def search(dialect, filters, user_id):
+    """Get (JOIN clause, WHERE condition, rank expression, params) of a full-text search of a user's prescriptions on filters, None if they hold no word
+
+    Lower ranks are better matches on both dialects: FTS5's bm25 rank on SQLite, the
+    negated sum of the columns' ts_rank on PostgreSQL (every word a prefix query there too).
+    """
+    if dialect != "postgresql":
+        expression = match(filters, user_id)
+        if not expression:
+            return None
+        return "JOIN search_index ON search_index.rowid = prescriptions.id", "search_index MATCH :match", "search_index.rank", {"match": expression}
+
+    conditions, ranks, params = [], [], {}
+    for column, value in filters.items():
+        words = _words(value)
+        if words:
+            # Quoted lexemes keep tsquery syntax out
+            query = f"to_tsquery('simple', :match_{column})"
+            conditions.append(f"search_index.{column} @@ {query}")
+            ranks.append(f"ts_rank(search_index.{column}, {query})")
+            params[f"match_{column}"] = " & ".join("'" + word.lower() + "':*" for word in words)
+    if not conditions:
+        return None
+    conditions.append("search_index.user_id = :match_user")
+    params["match_user"] = user_id
+    return "JOIN search_index ON search_index.prescription_id = prescriptions.id", " AND ".join(conditions), "-(" + " + ".join(ranks) + ")", params
+
+
+def match(filters, user_id):
+    """Build an FTS5 MATCH expression: every word of every filter as a column prefix query, on the user's rows"""
+    terms = []
+    for column, value in filters.items():
+        # (quotes keep FTS syntax out)
+        words = _words(value)
+        if words:
+            terms.append(f"{column} : (" + " AND ".join(f'"{word}"*' for word in words) + ")")
+    if not terms:
+        return ""
+    return " AND ".join(terms + [f'user_id : "{int(user_id)}"'])
@@ -0,0 +1,63 @@
+"""gunicorn settings, picked up automatically when starting from this directory:
+
+    gunicorn            (or: gunicorn -c gunicorn.conf.py app:app)
+
+The app is imported once in the master (migrations run once, templates compiled once)
+and forked into the workers. SQLite takes one writer at a time whatever the number of
+processes, so workers only scale reads: one per CPU, with a few threads each to
+overlap the waits on the write lock and the network. On PostgreSQL (DATABASE_URL) writes
+run concurrently too, and app servers on several hosts can share the database; each
+worker's pool is sized by DATABASE_POOL_SIZE and DATABASE_MAX_OVERFLOW.
+"""
+import multiprocessing
+import os
+
+
+wsgi_app = "app:app"
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+preload_app = True
+
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+worker_class = "gthread"
+# Long enough for a streamed export
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+keepalive = 5
+
+
+def _engines():
+    from app import engine, session_engine
+    return [engine, session_engine]
+
+
+def when_ready(server):
+    """Master: compile every template and hash the static files once, before forking"""
+    import assets
+    from app import app, archives
+
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    assets.version(app.static_folder)
+
+    # Connections opened while importing (migrations, archive year files read by them) must not be shared with the workers
+    for engine in _engines():
+        engine.dispose()
+    archives.dispose()
+
+
+def post_fork(server, worker):
+    """Worker: drop inherited pool connections, then open a warm pool of its own"""
+    from app import archives
+
+    for engine in _engines():
+        # close=False: leave the parent's connections alone, only forget them here
+        engine.dispose(close=False)
+    archives.dispose(close=False)
+
+    # One connection per thread (PRAGMAs applied on connect), returned to the pool
+    for engine in _engines():
+        connections = [engine.connect() for _ in range(min(threads, engine.pool.size()))]
+        for conn in connections:
+            conn.exec_driver_sql("SELECT 1")
+            conn.close()
+    worker.log.info("Worker %s warmed up", worker.pid)
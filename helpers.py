@@ -1,7 +1,10 @@
+import base64
+import json
 import re
 import requests
+from datetime import date, datetime, timezone
 
-from flask import redirect, render_template, session, request, url_for
+from flask import abort, current_app, redirect, render_template, session, request, url_for
 from functools import wraps
 
 
@@ -33,8 +36,70 @@ def check_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def form_medications(form):
+    """Medication rows (only those with a name) of a prescription form, numbered from 1"""
+    rows = zip(*(form.getlist(f"{field}[]") for field in ["med_name", "dose", "form", "schedule", "timing", "duration"]))
+    medications = []
+    for name, dose, med_form, schedule, timing, duration in rows:
+        if name: # Only if there's a name
+            medications.append({
+                "sequence": len(medications) + 1,
+                "med_name": name,
+                "dose": dose,
+                "form": med_form,
+                "schedule": schedule,
+                "timing": timing,
+                "duration": duration
+            })
+    return medications
+
 def norm(input):
     if input:
         return re.sub(r'\D', '', input)
     else:
-        return input
\ No newline at end of file
+        return input
+
+def visit_date(day, month, year, timestamp=None):
+    """Visit date 'YYYY-MM-DD' of a prescription's day/month/year, else the date of timestamp (default now, UTC)"""
+    try:
+        visit = date(int(year), int(month), int(day))
+        if visit.year >= 1900:
+            return visit.isoformat()
+    except (TypeError, ValueError):
+        pass
+    return str(timestamp or datetime.now(timezone.utc).isoformat())[:10]
+
+
+# Keyset pagination
+def page_size():
+    """Requested page size (?size=), defaults to PAGE_SIZE and capped at PAGE_SIZE_MAX"""
+    try:
+        size = int(request.values.get("size"))
+    except (TypeError, ValueError):
+        size = current_app.config["PAGE_SIZE"]
+    return max(1, min(size, current_app.config["PAGE_SIZE_MAX"]))
+
+def encode_cursor(values):
+    """Opaque cursor from the sort key values of the last row shown"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor, length=2):
+    """Sort key values of a cursor (length of them), None if missing, 400 Bad Request if tampered"""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        abort(400)
+    # Only scalar sort keys ever go into a cursor (they end up as bind parameters)
+    if (not isinstance(values, list) or len(values) != length
+            or any(isinstance(value, bool) or not isinstance(value, (str, int, float, type(None))) for value in values)):
+        abort(400)
+    return values
+
+def paginate(rows, size, keys):
+    """Split rows fetched with LIMIT size + 1 into the page and the cursor of the next page"""
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    return rows, encode_cursor([rows[-1][key] for key in keys])
@@ -0,0 +1,148 @@
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+
+from flask import request
+from sqlalchemy import event
+
+
+# Upper bounds (seconds) of the request latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# [queries, sql seconds, rows] of the request the current thread is serving (None outside requests)
+_current = threading.local()
+
+
+def _add(queries=0, seconds=0.0, rows=0):
+    stats = getattr(_current, "stats", None)
+    if stats is not None:
+        stats[0] += queries
+        stats[1] += seconds
+        stats[2] += rows
+
+
+class CountingCursor(sqlite3.Cursor):
+    """sqlite3 cursor counting the rows fetched from it"""
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            _add(rows=1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = super().fetchmany(*args, **kwargs)
+        _add(rows=len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        _add(rows=len(rows))
+        return rows
+
+
+class CountingConnection(sqlite3.Connection):
+    """sqlite3 connection handing out CountingCursors (create_engine(connect_args={"factory": ...}))"""
+
+    def cursor(self, factory=CountingCursor):
+        return super().cursor(factory)
+
+
+class _Route:
+    __slots__ = ("buckets", "sum", "count", "statuses", "queries", "sql_seconds", "rows")
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.statuses = {}
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.rows = 0
+
+
+class Metrics:
+    """Per route request latency histograms, status counts and SQL queries/time/rows of this process"""
+
+    def __init__(self):
+        self.routes = {}
+        # Extra counters read at scrape time: (name, help, function returning a number)
+        self.counters = []
+        self.lock = threading.Lock()
+
+    def instrument(self, app, engine):
+        """Time every request of app and the statements it runs on engine"""
+
+        @app.before_request
+        def start_request():
+            _current.stats = [0, 0.0, 0]
+            _current.started = time.perf_counter()
+
+        @app.after_request
+        def finish_request(response):
+            stats = getattr(_current, "stats", None)
+            if stats is not None:
+                _current.stats = None
+                # Streamed bodies are sent later, this is the time to the first byte
+                self.observe(request.endpoint or "unmatched", request.method, response.status_code, time.perf_counter() - _current.started, *stats)
+            return response
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def start_query(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def finish_query(conn, cursor, statement, parameters, context, executemany):
+            _add(queries=1, seconds=time.perf_counter() - conn.info["query_start"].pop())
+
+    def counter(self, name, help, function):
+        self.counters.append((name, help, function))
+
+    def observe(self, route, method, status, seconds, queries, sql_seconds, rows):
+        with self.lock:
+            stats = self.routes.get((route, method))
+            if stats is None:
+                stats = self.routes[(route, method)] = _Route()
+            stats.buckets[bisect_left(BUCKETS, seconds)] += 1
+            stats.sum += seconds
+            stats.count += 1
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            stats.queries += queries
+            stats.sql_seconds += sql_seconds
+            stats.rows += rows
+
+    def render(self):
+        """Everything in Prometheus text exposition format"""
+        with self.lock:
+            routes = sorted(self.routes.items())
+            lines = [
+                "# HELP http_request_duration_seconds Request latency by route.",
+                "# TYPE http_request_duration_seconds histogram",
+            ]
+            for (route, method), stats in routes:
+                labels = f'route="{route}",method="{method}"'
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), stats.buckets):
+                    cumulative += count
+                    lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"http_request_duration_seconds_sum{{{labels}}} {stats.sum}")
+                lines.append(f"http_request_duration_seconds_count{{{labels}}} {stats.count}")
+
+            lines += ["# HELP http_requests_total Requests by route and status.", "# TYPE http_requests_total counter"]
+            for (route, method), stats in routes:
+                for status, count in sorted(stats.statuses.items()):
+                    lines.append(f'http_requests_total{{route="{route}",method="{method}",status="{status}"}} {count}')
+
+            for name, help, attribute in [
+                ("db_queries_total", "SQL statements executed by route.", "queries"),
+                ("db_query_seconds_total", "Time spent executing SQL by route.", "sql_seconds"),
+                ("db_rows_total", "Rows fetched by route.", "rows"),
+            ]:
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} counter"]
+                for (route, method), stats in routes:
+                    lines.append(f'{name}{{route="{route}",method="{method}"}} {getattr(stats, attribute)}')
+
+        for name, help, function in self.counters:
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} counter", f"{name} {function()}"]
+        return "\n".join(lines) + "\n"
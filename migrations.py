@@ -0,0 +1,436 @@
+import ast
+import re
+
+from sqlalchemy import text
+
+import archive
+import database
+import fts
+import registry
+import stats
+import suggestions
+from helpers import visit_date
+
+
+# Tables of the original prescriptions.db, created for a fresh (empty) database
+BASE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+        username TEXT NOT NULL,
+        hash TEXT NOT NULL
+    )""",
+    "CREATE UNIQUE INDEX IF NOT EXISTS username ON users (username)",
+    """CREATE TABLE IF NOT EXISTS doctors (
+        user_id INTEGER PRIMARY KEY,
+        doctor_name TEXT NOT NULL,
+        qualification TEXT,
+        department TEXT,
+        registration TEXT,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )""",
+    """CREATE TABLE IF NOT EXISTS clinics (
+        user_id INTEGER PRIMARY KEY,
+        clinic_name TEXT NOT NULL,
+        address TEXT,
+        contact TEXT,
+        email TEXT,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )""",
+    """CREATE TABLE IF NOT EXISTS prescriptions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+        user_id INTEGER NOT NULL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        day INTEGER,
+        month INTEGER,
+        year INTEGER,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )""",
+    """CREATE TABLE IF NOT EXISTS patients (
+        prescription_id INTEGER NOT NULL,
+        patient_name TEXT,
+        age TEXT,
+        sex TEXT,
+        FOREIGN KEY(prescription_id) REFERENCES prescriptions(id) ON DELETE CASCADE
+    )""",
+    """CREATE TABLE IF NOT EXISTS vitals (
+        prescription_id INTEGER NOT NULL,
+        chief_complaints TEXT,
+        on_examination TEXT,
+        test_advised TEXT,
+        diagnosis TEXT,
+        FOREIGN KEY(prescription_id) REFERENCES prescriptions(id) ON DELETE CASCADE
+    )""",
+    """CREATE TABLE IF NOT EXISTS medications (
+        prescription_id INTEGER NOT NULL,
+        sequence INTEGER,
+        med_name TEXT,
+        dose TEXT,
+        timing TEXT,
+        form TEXT,
+        schedule TEXT,
+        duration TEXT,
+        user_id INTEGER NOT NULL,
+        FOREIGN KEY(prescription_id) REFERENCES prescriptions(id) ON DELETE CASCADE,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )""",
+]
+
+
+# The whole schema on a fresh PostgreSQL database, as of migration POSTGRES_VERSION (SQLite's history before
+# it doesn't apply there). prescriptions.timestamp is text like SQLite's CURRENT_TIMESTAMP, day/month/year as entered.
+POSTGRES_VERSION = 11
+POSTGRES_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        username TEXT NOT NULL,
+        hash TEXT NOT NULL,
+        info_version INTEGER NOT NULL DEFAULT 1,
+        data_version INTEGER NOT NULL DEFAULT 1
+    )""",
+    "CREATE UNIQUE INDEX IF NOT EXISTS username ON users (username)",
+    """CREATE TABLE IF NOT EXISTS doctors (
+        user_id INTEGER PRIMARY KEY,
+        doctor_name TEXT NOT NULL,
+        qualification TEXT,
+        department TEXT,
+        registration TEXT,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )""",
+    """CREATE TABLE IF NOT EXISTS clinics (
+        user_id INTEGER PRIMARY KEY,
+        clinic_name TEXT NOT NULL,
+        address TEXT,
+        contact TEXT,
+        email TEXT,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )""",
+    """CREATE TABLE IF NOT EXISTS patient_registry (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        name_key TEXT NOT NULL,
+        sex TEXT,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )""",
+    """CREATE TABLE IF NOT EXISTS prescriptions (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        timestamp TEXT NOT NULL DEFAULT to_char(CURRENT_TIMESTAMP AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS'),
+        day TEXT,
+        month TEXT,
+        year TEXT,
+        version INTEGER NOT NULL DEFAULT 1,
+        patient_id INTEGER REFERENCES patient_registry(id) ON DELETE SET NULL,
+        visit_date TEXT,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )""",
+    """CREATE TABLE IF NOT EXISTS patients (
+        prescription_id INTEGER NOT NULL,
+        patient_name TEXT,
+        age TEXT,
+        sex TEXT,
+        FOREIGN KEY(prescription_id) REFERENCES prescriptions(id) ON DELETE CASCADE
+    )""",
+    """CREATE TABLE IF NOT EXISTS vitals (
+        prescription_id INTEGER NOT NULL,
+        chief_complaints TEXT,
+        on_examination TEXT,
+        test_advised TEXT,
+        diagnosis TEXT,
+        FOREIGN KEY(prescription_id) REFERENCES prescriptions(id) ON DELETE CASCADE
+    )""",
+    """CREATE TABLE IF NOT EXISTS medications (
+        prescription_id INTEGER NOT NULL,
+        sequence INTEGER,
+        med_name TEXT,
+        dose TEXT,
+        timing TEXT,
+        form TEXT,
+        schedule TEXT,
+        duration TEXT,
+        user_id INTEGER NOT NULL,
+        FOREIGN KEY(prescription_id) REFERENCES prescriptions(id) ON DELETE CASCADE,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )""",
+    suggestions.SCHEMA,
+    suggestions.VERSIONS_SCHEMA,
+    *stats.SCHEMA,
+    archive.SCHEMA,
+    "CREATE INDEX IF NOT EXISTS patients_prescription ON patients (prescription_id)",
+    "CREATE INDEX IF NOT EXISTS vitals_prescription ON vitals (prescription_id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS medications_prescription ON medications (prescription_id, sequence)",
+    "CREATE INDEX IF NOT EXISTS medications_user ON medications (user_id)",
+    "CREATE INDEX IF NOT EXISTS prescriptions_user ON prescriptions (user_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS prescriptions_patient ON prescriptions (patient_id, visit_date)",
+    "CREATE INDEX IF NOT EXISTS prescriptions_visit ON prescriptions (user_id, visit_date, id)",
+    "CREATE INDEX IF NOT EXISTS med_versions_version ON med_versions (user_id, version)",
+    "CREATE INDEX IF NOT EXISTS patient_registry_key ON patient_registry (user_id, name_key)",
+    "CREATE INDEX IF NOT EXISTS archived_user ON archived (user_id, year)",
+    "CREATE INDEX IF NOT EXISTS archived_patient ON archived (patient_id, year)",
+]
+
+
+# Numbered schema changes, applied in order and recorded in PRAGMA user_version (PostgreSQL: schema_version)
+# PostgreSQL starts at POSTGRES_VERSION: migrations after it must run on both (check conn.dialect.name)
+# NOTE: only ever append to this list, never edit an already shipped migration
+def _med_suggestions(conn):
+    """1: medication suggestion counts (backfilled from history when first created)"""
+    exists = conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'med_suggestions'")).first()
+    conn.execute(text(suggestions.SCHEMA))
+    if not exists:
+        suggestions.rebuild(conn)
+
+
+def _lookup_indexes(conn):
+    """2: indexes for the per prescription and per user lookups"""
+    conn.execute(text("CREATE INDEX IF NOT EXISTS patients_prescription ON patients (prescription_id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS vitals_prescription ON vitals (prescription_id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS medications_prescription ON medications (prescription_id, sequence)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS medications_user ON medications (user_id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS prescriptions_user ON prescriptions (user_id, timestamp)"))
+
+
+def _search_index(conn):
+    """3: FTS5 full-text search index kept in sync by triggers (as shipped, replaced by 13)"""
+    conn.execute(text("""CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        patient_name, med_name, form, dose, chief_complaints, diagnosis,
+        user_id UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )"""))
+    for table, columns in {"patients": "patient_name", "vitals": "chief_complaints, diagnosis", "medications": "med_name, form, dose"}.items():
+        for event, row in [("INSERT", "NEW"), (f"UPDATE OF {columns}", "NEW"), ("DELETE", "OLD")]:
+            name = f"search_index_{table}_{event.split()[0].lower()}"
+            conn.execute(text(f"""CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table} BEGIN
+                DELETE FROM search_index WHERE rowid = {row}.prescription_id;
+                {fts.INDEX_ROWS} WHERE prescriptions.id = {row}.prescription_id;
+                END"""))
+    conn.execute(text("""CREATE TRIGGER IF NOT EXISTS search_index_prescriptions_delete AFTER DELETE ON prescriptions BEGIN
+        DELETE FROM search_index WHERE rowid = OLD.id;
+        END"""))
+    conn.execute(text(fts.INDEX_ROWS))
+
+
+def _unique_medication_sequence(conn):
+    """4: one medication per (prescription_id, sequence), needed by the upserting write path"""
+    conn.execute(text("DELETE FROM medications WHERE rowid NOT IN (SELECT MIN(rowid) FROM medications GROUP BY prescription_id, sequence)"))
+    conn.execute(text("DROP INDEX IF EXISTS medications_prescription"))
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS medications_prescription ON medications (prescription_id, sequence)"))
+    suggestions.rebuild(conn)
+
+
+def _versions(conn):
+    """5: version counters of cached renderings, bumped by every write to a prescription or to the doctor/clinic info"""
+    conn.execute(text("ALTER TABLE prescriptions ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+    conn.execute(text("ALTER TABLE users ADD COLUMN info_version INTEGER NOT NULL DEFAULT 1"))
+
+
+def _data_version(conn):
+    """6: version counter of a doctor's prescription list, bumped by every prescription write (history ETag)"""
+    conn.execute(text("ALTER TABLE users ADD COLUMN data_version INTEGER NOT NULL DEFAULT 1"))
+
+
+def _med_versions(conn):
+    """7: versions of medData entries for the delta sync (/med-data?since=)"""
+    conn.execute(text(suggestions.VERSIONS_SCHEMA))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS med_versions_version ON med_versions (user_id, version)"))
+    conn.execute(text("INSERT OR IGNORE INTO med_versions(user_id, med_name, version) SELECT DISTINCT user_id, med_name, 1 FROM med_suggestions"))
+
+
+def _stats(conn):
+    """8: practice statistics summary tables (filled from history by 12)"""
+    for statement in stats.SCHEMA:
+        conn.execute(text(statement))
+
+
+def _patient_registry(conn):
+    """9: per doctor patient registry linked from prescriptions (existing rows linked by flask link-patients)"""
+    conn.execute(text(registry.SCHEMA))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS patient_registry_key ON patient_registry (user_id, name_key)"))
+    conn.execute(text("ALTER TABLE prescriptions ADD COLUMN patient_id INTEGER REFERENCES patient_registry(id) ON DELETE SET NULL"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS prescriptions_patient ON prescriptions (patient_id, timestamp)"))
+
+
+def _visit_date(conn):
+    """10: indexed visit date ('YYYY-MM-DD') from day/month/year (else the timestamp's date) for date ranges and ordering"""
+    conn.execute(text("ALTER TABLE prescriptions ADD COLUMN visit_date TEXT"))
+    after = 0
+    while rows := conn.execute(
+        text("SELECT id, day, month, year, timestamp FROM prescriptions WHERE id > :after ORDER BY id LIMIT 1000"), {"after": after}
+    ).all():
+        conn.execute(
+            text("UPDATE prescriptions SET visit_date = :visit WHERE id = :id"),
+            [{"id": row.id, "visit": visit_date(row.day, row.month, row.year, row.timestamp)} for row in rows]
+        )
+        after = rows[-1].id
+    conn.execute(text("CREATE INDEX IF NOT EXISTS prescriptions_visit ON prescriptions (user_id, visit_date, id)"))
+    # Patient timelines are listed by visit date as well
+    conn.execute(text("DROP INDEX IF EXISTS prescriptions_patient"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS prescriptions_patient ON prescriptions (patient_id, visit_date)"))
+
+
+def _archive_catalog(conn):
+    """11: catalog of the prescriptions moved to the per year archive files"""
+    conn.execute(text(archive.SCHEMA))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS archived_user ON archived (user_id, year)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS archived_patient ON archived (patient_id, year)"))
+
+
+def _stats_visit_month(conn):
+    """12: prescriptions per month counted by visit month instead of insert time (archived ones too)"""
+    stats.rebuild(conn, archives=conn.info.get("archives"))
+
+
+def _search_index_per_write(conn):
+    """13: search_index rows written by the saves themselves instead of 3's per row triggers, user_id indexed for MATCH"""
+    if conn.dialect.name == "postgresql":
+        for table in ["patients", "vitals", "medications"]:
+            conn.execute(text(f"DROP TRIGGER IF EXISTS search_index_{table} ON {table}"))
+        conn.execute(text("DROP FUNCTION IF EXISTS search_index_refresh()"))
+        return
+    for table in ["patients", "vitals", "medications"]:
+        for event in ["insert", "update", "delete"]:
+            conn.execute(text(f"DROP TRIGGER IF EXISTS search_index_{table}_{event}"))
+    conn.execute(text("DROP TRIGGER IF EXISTS search_index_prescriptions_delete"))
+    conn.execute(text("DROP TABLE search_index"))
+    fts.create(conn)
+    # The year files' search_index too (their own tables hold the rows)
+    archives = conn.info.get("archives")
+    if archives:
+        for year in conn.execute(text("SELECT DISTINCT year FROM archived")).scalars():
+            archive.reindex(archives.folder, year)
+
+
+def _unique_registry_entries(conn):
+    """14: registry entries unique per doctor, name key and sex, duplicates merged into the oldest entry"""
+    duplicates = conn.execute(text(f"""SELECT entry.id, kept.id AS keep FROM patient_registry AS entry
+        JOIN (SELECT user_id, name_key, {registry.SEX_KEY} AS sex_key, MIN(id) AS id FROM patient_registry
+            GROUP BY user_id, name_key, {registry.SEX_KEY} HAVING COUNT(*) > 1) AS kept
+        ON entry.user_id = kept.user_id AND entry.name_key = kept.name_key AND {registry.SEX_KEY} = kept.sex_key
+        WHERE entry.id != kept.id""")).all()
+    if duplicates:
+        params = [{"keep": row.keep, "id": row.id} for row in duplicates]
+        conn.execute(text("UPDATE prescriptions SET patient_id = :keep, version = version + 1 WHERE patient_id = :id"), params)
+        conn.execute(text("UPDATE archived SET patient_id = :keep WHERE patient_id = :id"), params)
+        conn.execute(text("DELETE FROM patient_registry WHERE id = :id"), params)
+    # (replaces the plain (user_id, name_key) index)
+    conn.execute(text("DROP INDEX IF EXISTS patient_registry_key"))
+    conn.execute(text(registry.UNIQUE_INDEX))
+
+
+MIGRATIONS = [
+    _med_suggestions,
+    _lookup_indexes,
+    _search_index,
+    _unique_medication_sequence,
+    _versions,
+    _data_version,
+    _med_versions,
+    _stats,
+    _patient_registry,
+    _visit_date,
+    _archive_catalog,
+    _stats_visit_month,
+    _search_index_per_write,
+    _unique_registry_entries,
+]
+
+
+def _lock(conn):
+    # SQLite transactions here hold the write lock already (BEGIN IMMEDIATE), on PostgreSQL
+    # one worker at a time takes this transaction level advisory lock
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('migrations'))"))
+
+
+def version(conn):
+    """Current schema version of the database"""
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+        return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+    return conn.execute(text("PRAGMA user_version")).scalar()
+
+
+def set_version(conn, number):
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("DELETE FROM schema_version"))
+        conn.execute(text("INSERT INTO schema_version(version) VALUES (:number)"), {"number": number})
+    else:
+        conn.execute(text(f"PRAGMA user_version = {number}"))
+
+
+def migrate(engine, archives=None):
+    """Apply every pending migration, each in its own transaction
+
+    Migrations find the archive.Archive of the year files, if given, in conn.info["archives"].
+    """
+    applied = []
+
+    def base_schema(conn):
+        _lock(conn)
+        current = version(conn)
+        if current == 0 and conn.dialect.name == "postgresql":
+            for statement in POSTGRES_SCHEMA:
+                conn.execute(text(statement))
+            fts.create(conn)
+            set_version(conn, POSTGRES_VERSION)
+            current = POSTGRES_VERSION
+        elif current == 0:
+            for statement in BASE_SCHEMA:
+                conn.execute(text(statement))
+        return current
+
+    # Write transactions (write lock taken up front), workers may start at the same time
+    current = database.write(engine, base_schema)
+    for number, migration in enumerate(MIGRATIONS, start=1):
+        if number <= current:
+            continue
+
+        def apply(conn):
+            # Re-check inside the transaction in case another worker got here first
+            _lock(conn)
+            if version(conn) >= number:
+                return False
+            conn.info["archives"] = archives
+            try:
+                migration(conn)
+            finally:
+                conn.info.pop("archives")
+            set_version(conn, number)
+            return True
+
+        if database.write(engine, apply):
+            applied.append(number)
+    return applied
+
+
+# Query plan checking
+def statements(path):
+    """Get every literal SQL statement passed to text() in a python file"""
+    with open(path) as file:
+        tree = ast.parse(file.read(), filename=path)
+
+    found = []
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Call) and getattr(node.func, "id", None) == "text"
+                and node.args and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str)):
+            found.append((node.lineno, " ".join(node.args[0].value.split())))
+    return sorted(found)
+
+
+def full_scan(detail):
+    """Whether an EXPLAIN QUERY PLAN step reads a whole table
+
+    A virtual table step is a full scan only without constraints (FTS5's 'INDEX 0:'),
+    one with a MATCH or rowid constraint ('INDEX 0:M7') is a lookup.
+    """
+    if detail.startswith("SCAN") and "VIRTUAL TABLE" in detail:
+        return re.search(r"VIRTUAL TABLE INDEX \d+:$", detail) is not None
+    return detail.startswith("SCAN") and detail != "SCAN CONSTANT ROW"
+
+
+def scans(conn, sql):
+    """Get the full table SCAN steps of a statement's EXPLAIN QUERY PLAN"""
+    # Bind every :param to NULL, only the plan is of interest
+    params = {name: None for name in re.findall(r"(?<!:):(\w+)", sql)}
+    plan = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params).mappings().all()
+    return [row["detail"] for row in plan if full_scan(row["detail"])]
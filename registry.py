@@ -0,0 +1,177 @@
+import difflib
+import re
+import unicodedata
+
+from sqlalchemy import text
+
+import database
+
+
+# One entry per patient of a doctor, prescriptions link to it (prescriptions.patient_id)
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS patient_registry (
+        id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+        user_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        name_key TEXT NOT NULL,
+        sex TEXT,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )
+"""
+
+# One entry per name key and sex (first letter, '' if unknown): of two concurrent saves of a
+# new patient the second gets the first one's entry (ON CONFLICT in _create)
+SEX_KEY = "COALESCE(lower(substr(trim(sex), 1, 1)), '')"
+UNIQUE_INDEX = f"CREATE UNIQUE INDEX IF NOT EXISTS patient_registry_key ON patient_registry (user_id, name_key, ({SEX_KEY}))"
+
+# Similarity (difflib ratio of name keys) from which the backfill takes two names for the same patient
+CUTOFF = 0.85
+
+
+def key(name):
+    """Normalized name: lowercase words without accents or punctuation ("  Md. Rahím " -> "md rahim")"""
+    name = "".join(char for char in unicodedata.normalize("NFKD", name or "") if not unicodedata.combining(char))
+    return " ".join(re.findall(r"[^\W_]+", name.lower()))
+
+
+def _same_sex(a, b):
+    # Unknown matches anything, else compare the first letter ("M" == "Male")
+    a, b = (a or "").strip().lower(), (b or "").strip().lower()
+    return not a or not b or a[0] == b[0]
+
+
+class Matcher:
+    """A doctor's registry entries in memory: exact name key first, then (with a cutoff) the most similar keys"""
+
+    def __init__(self, entries, cutoff=None):
+        self.cutoff = cutoff
+        self.keys = {}      # {name_key: [(id, sex), ...]}
+        self.blocks = {}    # {first letter: [name_key, ...]}, only keys of the same block are compared
+        for id, name_key, sex in entries:
+            self.add(id, name_key, sex)
+
+    def add(self, id, name_key, sex):
+        if name_key not in self.keys:
+            self.blocks.setdefault(name_key[0], []).append(name_key)
+        self.keys.setdefault(name_key, []).append((id, sex))
+
+    def match(self, name_key, sex):
+        """Get the id of the matching entry, None if there is none"""
+        candidates = [name_key]
+        if self.cutoff:
+            candidates += difflib.get_close_matches(name_key, self.blocks.get(name_key[0], []), n=3, cutoff=self.cutoff)
+        for candidate in candidates:
+            for id, entry_sex in self.keys.get(candidate, []):
+                if _same_sex(entry_sex, sex):
+                    return id
+        return None
+
+
+def _create(conn, user_id, name, name_key, sex):
+    return conn.execute(
+        text(f"""INSERT INTO patient_registry(user_id, name, name_key, sex) VALUES (:uid, :name, :key, :sex)
+            ON CONFLICT(user_id, name_key, ({SEX_KEY})) DO UPDATE SET name_key = excluded.name_key RETURNING id"""),
+        {"uid": user_id, "name": " ".join(name.split()), "key": name_key, "sex": sex or None}
+    ).scalar()
+
+
+def find_or_create(conn, user_id, name, sex=None):
+    """Get the registry id of a doctor's patient by exact name key, creating the entry for a new patient"""
+    name_key = key(name)
+    if not name_key:
+        return None
+    entries = conn.execute(
+        text("SELECT id, name_key, sex FROM patient_registry WHERE user_id = :uid AND name_key = :key ORDER BY id"),
+        {"uid": user_id, "key": name_key}
+    ).all()
+    patient_id = Matcher(entries).match(name_key, sex)
+    if patient_id is None:
+        patient_id = _create(conn, user_id, name, name_key, sex)
+    return patient_id
+
+
+def prune(conn, patient_id):
+    """Delete a registry entry no prescription links to anymore (e.g. after renaming the patient of its only visit)"""
+    conn.execute(
+        text("""DELETE FROM patient_registry WHERE id = :id AND NOT EXISTS (SELECT 1 FROM prescriptions WHERE patient_id = :id)
+            AND NOT EXISTS (SELECT 1 FROM archived WHERE patient_id = :id)"""),
+        {"id": patient_id}
+    )
+
+
+def link(conn, user_id, rows, cutoff=None):
+    """Link prescriptions [{"prid": ..., "patient_name": ..., "sex": ...}, ...] to the doctor's registry entries
+
+    Missing entries are created. Names match on their exact key, or with a cutoff on
+    similar keys as well. Returns the number of prescriptions linked.
+    """
+    entries = conn.execute(text("SELECT id, name_key, sex FROM patient_registry WHERE user_id = :uid"), {"uid": user_id}).all()
+    matcher = Matcher(entries, cutoff)
+
+    links = []
+    for row in rows:
+        name_key = key(row["patient_name"])
+        if not name_key:
+            continue
+        patient_id = matcher.match(name_key, row["sex"])
+        if patient_id is None:
+            patient_id = _create(conn, user_id, row["patient_name"], name_key, row["sex"])
+            matcher.add(patient_id, name_key, row["sex"])
+        links.append({"pid": patient_id, "prid": row["prid"]})
+
+    # Cached renderings of the prescriptions get the patient link
+    if links:
+        conn.execute(text("UPDATE prescriptions SET patient_id = :pid, version = version + 1 WHERE id = :prid"), links)
+    return len(links)
+
+
+def backfill(engine, user_id, batch_size=500, cutoff=CUTOFF, progress=None):
+    """Link a doctor's unlinked prescriptions oldest first, one write transaction per batch, returns the number linked
+
+    progress(linked) is called after every batch.
+    """
+    linked = 0
+    after = 0
+    while after is not None:
+        def link_batch(conn):
+            rows = conn.execute(
+                text("""SELECT prescriptions.id AS prid, patients.patient_name, patients.sex FROM prescriptions
+                    JOIN patients ON patients.prescription_id = prescriptions.id
+                    WHERE prescriptions.user_id = :uid AND prescriptions.patient_id IS NULL AND prescriptions.id > :after
+                    ORDER BY prescriptions.id LIMIT :limit"""),
+                {"uid": user_id, "after": after, "limit": batch_size}
+            ).mappings().all()
+            count = link(conn, user_id, rows, cutoff)
+            if count:
+                conn.execute(text("UPDATE users SET data_version = data_version + 1 WHERE id = :uid"), {"uid": user_id})
+            # Rows without a name stay unlinked, the next batch starts after them
+            return (rows[-1]["prid"] if rows else None), count
+
+        after, count = database.write(engine, link_batch)
+        linked += count
+        if progress and count:
+            progress(linked)
+    return linked
+
+
+# A patient's visits (:id) of a doctor (:uid), latest first
+VISITS = """
+    SELECT prescriptions.id, prescriptions.day, prescriptions.month, prescriptions.year, prescriptions.visit_date,
+        patients.patient_name, patients.age, vitals.chief_complaints, vitals.diagnosis FROM prescriptions
+    LEFT JOIN patients ON patients.prescription_id = prescriptions.id
+    LEFT JOIN vitals ON vitals.prescription_id = prescriptions.id
+    WHERE prescriptions.patient_id = :id AND prescriptions.user_id = :uid
+    ORDER BY prescriptions.visit_date DESC, prescriptions.id DESC
+"""
+
+
+def timeline(conn, user_id, patient_id):
+    """Get a doctor's registry entry and all the patient's visits newest first, (None, []) if it isn't theirs"""
+    patient = conn.execute(
+        text("SELECT id, name, sex FROM patient_registry WHERE id = :id AND user_id = :uid"),
+        {"id": patient_id, "uid": user_id}
+    ).mappings().first()
+    if not patient:
+        return None, []
+    visits = conn.execute(text(VISITS), {"id": patient_id, "uid": user_id}).mappings().all()
+    return patient, visits
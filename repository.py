@@ -0,0 +1,148 @@
+import json
+from dataclasses import dataclass
+from types import MappingProxyType
+
+from sqlalchemy import bindparam, text
+
+import suggestions
+
+
+# Columns loaded for each part of a prescription
+COLUMNS = {
+    "prescriptions": ["id", "user_id", "patient_id", "timestamp", "day", "month", "year", "visit_date"],
+    "patients": ["prescription_id", "patient_name", "age", "sex"],
+    "vitals": ["prescription_id", "chief_complaints", "on_examination", "test_advised", "diagnosis"],
+    "medications": ["prescription_id", "sequence", "med_name", "dose", "timing", "form", "schedule", "duration", "user_id"],
+}
+
+# Medication columns written from the prescription form
+MED_FIELDS = ["med_name", "dose", "form", "schedule", "timing", "duration"]
+
+
+@dataclass(frozen=True)
+class Prescription:
+    """A whole prescription, read-only: prescription, patient and vital rows plus medication rows in sequence"""
+    prescription: MappingProxyType
+    patient: MappingProxyType
+    vital: MappingProxyType
+    medications: tuple
+
+
+def _object(table, function="json_object"):
+    # json_object('col', table.col, ...) of a table's loaded columns
+    return f"{function}(" + ", ".join(f"'{column}', {table}.{column}" for column in COLUMNS[table]) + ")"
+
+
+# The whole prescription graph, one row per prescription, children aggregated as JSON
+GRAPH = f"""
+    SELECT
+        {_object("prescriptions")} AS prescription,
+        (SELECT {_object("patients")} FROM patients WHERE patients.prescription_id = prescriptions.id LIMIT 1) AS patient,
+        (SELECT {_object("vitals")} FROM vitals WHERE vitals.prescription_id = prescriptions.id LIMIT 1) AS vital,
+        (SELECT json_group_array({_object("medications")}) FROM medications WHERE medications.prescription_id = prescriptions.id) AS medications
+    FROM prescriptions
+"""
+
+# Same on PostgreSQL (JSON as text, decoded like SQLite's)
+POSTGRES_GRAPH = f"""
+    SELECT
+        {_object("prescriptions", "json_build_object")}::text AS prescription,
+        (SELECT {_object("patients", "json_build_object")}::text FROM patients WHERE patients.prescription_id = prescriptions.id LIMIT 1) AS patient,
+        (SELECT {_object("vitals", "json_build_object")}::text FROM vitals WHERE vitals.prescription_id = prescriptions.id LIMIT 1) AS vital,
+        (SELECT json_agg({_object("medications", "json_build_object")})::text FROM medications WHERE medications.prescription_id = prescriptions.id) AS medications
+    FROM prescriptions
+"""
+
+
+def _graph(conn):
+    return POSTGRES_GRAPH if conn.dialect.name == "postgresql" else GRAPH
+
+
+def _record(row):
+    medications = sorted(json.loads(row["medications"] or "[]"), key=lambda med: med["sequence"] or 0)
+    return Prescription(
+        prescription=MappingProxyType(json.loads(row["prescription"])),
+        patient=MappingProxyType(json.loads(row["patient"] or "{}")),
+        vital=MappingProxyType(json.loads(row["vital"] or "{}")),
+        medications=tuple(MappingProxyType(med) for med in medications),
+    )
+
+
+def load_many(conn, user_id, ids):
+    """Get {id: Prescription} of the user's prescriptions among ids, in one query"""
+    if not ids:
+        return {}
+    rows = conn.execute(
+        text(_graph(conn) + " WHERE prescriptions.id IN :ids AND prescriptions.user_id = :uid").bindparams(bindparam("ids", expanding=True)),
+        {"ids": list(ids), "uid": user_id}
+    ).mappings().all()
+    records = {}
+    for row in rows:
+        record = _record(row)
+        records[record.prescription["id"]] = record
+    return {id: records[id] for id in ids if id in records}
+
+
+def load(conn, user_id, prescription_id):
+    """Get a user's Prescription, None if it doesn't exist or belongs to someone else"""
+    return load_many(conn, user_id, [prescription_id]).get(prescription_id)
+
+
+def stream(conn, user_id, start=None, end=None):
+    """Yield a user's Prescriptions oldest visit first, read from the cursor in chunks
+
+    start (inclusive) and end (exclusive) are optional 'YYYY-MM-DD' bounds on the visit date.
+    """
+    query = _graph(conn) + " WHERE prescriptions.user_id = :uid"
+    params = {"uid": user_id}
+    if start:
+        query += " AND prescriptions.visit_date >= :start"
+        params["start"] = start
+    if end:
+        query += " AND prescriptions.visit_date < :end"
+        params["end"] = end
+    result = conn.execution_options(yield_per=200).execute(text(query + " ORDER BY prescriptions.visit_date, prescriptions.id"), params)
+    for row in result.mappings():
+        yield _record(row)
+
+
+def save_medications(conn, user_id, prescription_id, medications, stored=None):
+    """Write a prescription's medication list as a diff against the stored rows
+
+    medications: [{"sequence": 1, "med_name": ..., "dose": ..., ...}, ...]
+    stored: the current rows if already known (e.g. [] for a new prescription)
+    Returns (removed, added) rows, also applied to the medData suggestion counts.
+    """
+    if stored is None:
+        stored = conn.execute(
+            text("SELECT sequence, med_name, dose, form, schedule, timing, duration FROM medications WHERE prescription_id = :prid"),
+            {"prid": prescription_id}
+        ).mappings().all()
+    old = {row["sequence"]: dict(row) for row in stored}
+    new = {med["sequence"]: med for med in medications}
+
+    # Rows to (re)write: new sequences plus changed ones, rows to delete: sequences gone from the form
+    changed = [med for seq, med in new.items() if seq not in old or any(old[seq][field] != med[field] for field in MED_FIELDS)]
+    deleted = [seq for seq in old if seq not in new]
+
+    if changed:
+        conn.execute(
+            text("""INSERT INTO medications
+                (prescription_id, sequence, med_name, dose, form, schedule, timing, duration, user_id)
+                VALUES (:prid, :sequence, :med_name, :dose, :form, :schedule, :timing, :duration, :uid)
+                ON CONFLICT(prescription_id, sequence) DO UPDATE SET
+                med_name = excluded.med_name, dose = excluded.dose, form = excluded.form,
+                schedule = excluded.schedule, timing = excluded.timing, duration = excluded.duration"""),
+            [{"prid": prescription_id, "uid": user_id, **med} for med in changed]
+        )
+    if deleted:
+        conn.execute(
+            text("DELETE FROM medications WHERE prescription_id = :prid AND sequence = :seq"),
+            [{"prid": prescription_id, "seq": seq} for seq in deleted]
+        )
+
+    # Move medData suggestion counts from the replaced values to the new ones
+    removed = [old[med["sequence"]] for med in changed if med["sequence"] in old] + [old[seq] for seq in deleted]
+    suggestions.record(conn, user_id, removed, delta=-1)
+    suggestions.record(conn, user_id, changed)
+    return removed, changed
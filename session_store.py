@@ -0,0 +1,133 @@
+import secrets
+import threading
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from sqlalchemy import text
+from werkzeug.datastructures import CallbackDict
+
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS sessions (
+        id TEXT PRIMARY KEY NOT NULL,
+        data TEXT NOT NULL,
+        expiry INTEGER NOT NULL
+    ) WITHOUT ROWID""",
+    "CREATE INDEX IF NOT EXISTS sessions_expiry ON sessions (expiry)",
+]
+
+POSTGRES_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS sessions (
+        id TEXT PRIMARY KEY NOT NULL,
+        data TEXT NOT NULL,
+        expiry BIGINT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS sessions_expiry ON sessions (expiry)",
+]
+
+
+class SqliteSession(CallbackDict, SessionMixin):
+    """Server side session, only the random id lives in the cookie"""
+
+    def __init__(self, initial=None, sid=None, data=None, expiry=0):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        # Stored payload and expiry, to write back only what changed
+        self.data = data
+        self.expiry = expiry
+        self.modified = False
+
+
+class SqliteSessionInterface(SessionInterface):
+    """Sessions stored in an indexed SQLite (or PostgreSQL) table, expired rows swept in batches
+
+    Every worker process talks to the same table, the database's locking keeps it consistent.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, engine, sweep_interval=300, sweep_batch=500):
+        self.engine = engine
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+        self.next_sweep = 0
+        self.sweep_lock = threading.Lock()
+
+    def create(self):
+        with self.engine.begin() as conn:
+            for statement in POSTGRES_SCHEMA if conn.dialect.name == "postgresql" else SCHEMA:
+                conn.execute(text(statement))
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            with self.engine.connect() as conn:
+                row = conn.execute(
+                    text("SELECT data, expiry FROM sessions WHERE id = :id AND expiry > :now"),
+                    {"id": sid, "now": int(time.time())}
+                ).first()
+            if row:
+                return SqliteSession(self.serializer.loads(row.data), sid=sid, data=row.data, expiry=row.expiry)
+        return SqliteSession(sid=secrets.token_urlsafe(32))
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        response.vary.add("Cookie")
+
+        # Emptied session (e.g. logout): forget it
+        if not session:
+            if session.data is not None:
+                with self.engine.begin() as conn:
+                    conn.execute(text("DELETE FROM sessions WHERE id = :id"), {"id": session.sid})
+                response.delete_cookie(name, domain=domain, path=path)
+            self.sweep()
+            return
+
+        # Write back only a changed payload, or to push back expiry when half the lifetime is gone
+        now = int(time.time())
+        lifetime = int(app.permanent_session_lifetime.total_seconds())
+        data = self.serializer.dumps(dict(session))
+        if data != session.data or session.expiry - now < lifetime // 2:
+            with self.engine.begin() as conn:
+                conn.execute(
+                    text("""INSERT INTO sessions(id, data, expiry) VALUES (:id, :data, :expiry)
+                        ON CONFLICT(id) DO UPDATE SET data = excluded.data, expiry = excluded.expiry"""),
+                    {"id": session.sid, "data": data, "expiry": now + lifetime}
+                )
+
+        # Cookie only for new sessions (or every time with SESSION_REFRESH_EACH_REQUEST on permanent ones)
+        if session.data is None or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+        self.sweep()
+
+    def sweep(self):
+        """Delete expired sessions in small batches, at most once per sweep_interval per worker"""
+        if time.monotonic() < self.next_sweep or not self.sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self.next_sweep = time.monotonic() + self.sweep_interval
+            while True:
+                # One short write transaction per batch
+                with self.engine.begin() as conn:
+                    deleted = conn.execute(
+                        text("DELETE FROM sessions WHERE id IN (SELECT id FROM sessions WHERE expiry <= :now LIMIT :batch)"),
+                        {"now": int(time.time()), "batch": self.sweep_batch}
+                    ).rowcount
+                if deleted < self.sweep_batch:
+                    break
+        finally:
+            self.sweep_lock.release()
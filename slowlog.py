@@ -0,0 +1,102 @@
+import json
+import logging
+import logging.handlers
+import re
+import time
+
+from sqlalchemy import event
+
+
+# Statements worth an EXPLAIN QUERY PLAN
+PLANNED = ("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")
+
+
+def normalize(sql):
+    """SQL with literals replaced by ? and whitespace collapsed, same text for every run of a statement"""
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+    return " ".join(sql.split())
+
+
+def shape(parameters):
+    """Names and types of bound parameters, never their values (patient data)"""
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            # executemany: shape of the first row and the number of rows
+            return {"rows": len(parameters), "row": shape(parameters[0])}
+        return [type(value).__name__ for value in parameters]
+    return None
+
+
+class SlowQueryLog:
+    """Statements slower than threshold_ms written to a rotating log as JSON lines, with their query plan"""
+
+    def __init__(self, path, threshold_ms, max_bytes=10 * 1024 * 1024, backups=3):
+        self.threshold = threshold_ms / 1000
+        self.logger = logging.getLogger(f"slowlog.{path}")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        if not self.logger.handlers:
+            self.logger.addHandler(logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups))
+
+    def instrument(self, engine):
+        @event.listens_for(engine, "before_cursor_execute")
+        def start_query(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("slowlog_start", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def finish_query(conn, cursor, statement, parameters, context, executemany):
+            seconds = time.perf_counter() - conn.info["slowlog_start"].pop()
+            if seconds >= self.threshold:
+                self.log(cursor, statement, parameters, executemany, seconds, conn.dialect.name)
+
+    def log(self, cursor, statement, parameters, executemany, seconds, dialect="sqlite"):
+        entry = {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "ms": round(seconds * 1000, 3),
+            "sql": normalize(statement),
+            "params": shape(parameters),
+            # (a failed EXPLAIN would abort a PostgreSQL transaction, use its auto_explain there)
+            "plan": self.plan(cursor, statement, parameters[0] if executemany else parameters) if dialect == "sqlite" else None,
+        }
+        self.logger.info(json.dumps(entry))
+
+    @staticmethod
+    def plan(cursor, statement, parameters):
+        # Planned with the real parameters on a fresh cursor of the same connection, only the plan is kept
+        if not statement.lstrip().upper().startswith(PLANNED):
+            return None
+        try:
+            explain = cursor.connection.cursor()
+            try:
+                return [row[-1] for row in explain.execute(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()]
+            finally:
+                explain.close()
+        except Exception as error:
+            return [f"EXPLAIN failed: {error}"]
+
+
+def summarize(paths):
+    """Per normalized statement: count, total/max/mean ms and the latest plan, worst total time first"""
+    statements = {}
+    for path in paths:
+        try:
+            file = open(path)
+        except FileNotFoundError:
+            continue
+        with file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                stats = statements.setdefault(entry["sql"], {"sql": entry["sql"], "count": 0, "total_ms": 0.0, "max_ms": 0.0, "plan": None})
+                stats["count"] += 1
+                stats["total_ms"] += entry["ms"]
+                stats["max_ms"] = max(stats["max_ms"], entry["ms"])
+                stats["plan"] = entry["plan"]
+    for stats in statements.values():
+        stats["mean_ms"] = stats["total_ms"] / stats["count"]
+    return sorted(statements.values(), key=lambda stats: stats["total_ms"], reverse=True)
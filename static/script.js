@@ -106,7 +106,7 @@ function setTodayDate(dayId, monthId, yearId) {
 // Clear localStorage (with 1sec delay if account to prevent delet before submit)
 function clearData(name) {
     if (name === 'all') {
-        ["medData", "doctorRow", "clinicRow"].forEach(key => {
+        ["medData", "medDataVersion", "doctorRow", "clinicRow"].forEach(key => {
             if (localStorage.getItem(key)) {
                 localStorage.removeItem(key);
             }
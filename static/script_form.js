@@ -2,18 +2,8 @@
 // Initial Setup after DOM
 document.addEventListener('DOMContentLoaded', function () {
     // ---Med-list---
-    // Get med_list, datalist
-    const medList = safeEl('med_list');
-    if (!medList || !medData) return; // Return if non-existing
-    // Proceed
-    // Clear existing options
-    medList.innerHTML = '';
-    // Populate options
-    Object.keys(medData).forEach(medName => {
-        const option = document.createElement('option');
-        option.value = medName;
-        medList.appendChild(option);
-    });
+    // Bring medData up to date (only changed entries are sent), then fill med_list datalist
+    syncMedData().then(setMedList);
 
     // Default-no-enter function
     document.querySelector('.prescription').addEventListener('keydown', function(e) {
@@ -212,6 +202,45 @@ function setNameList(element) {
     safeEl(`med_list_${rowNum}`).innerHTML = html;
 }
 
+// ---medData---
+// Local copy of medData {med_name: {type_data: [Data,...],...},...} and its version
+let medData = JSON.parse(localStorage.getItem("medData") || "{}");
+
+// Get changes since the stored version from the server and apply them
+async function syncMedData() {
+    const version = localStorage.getItem("medDataVersion");
+    const since = (version !== null && Object.keys(medData).length) ? `?since=${version}` : '';
+    try {
+        const response = await fetch(`/med-data${since}`);
+        if (!response.ok) return;
+        const delta = await response.json();
+        // Whole payload if the version was unknown, else only changed and removed medications
+        if (delta.full) medData = {};
+        Object.assign(medData, delta.med_data);
+        delta.removed.forEach(medName => delete medData[medName]);
+        localStorage.setItem("medData", JSON.stringify(medData));
+        localStorage.setItem("medDataVersion", delta.version);
+    } catch (error) {
+        console.log("medData sync failed:", error);
+    }
+}
+
+// Fill med_list datalist with all med names
+function setMedList() {
+    // Get med_list, datalist
+    const medList = safeEl('med_list');
+    if (!medList) return; // Return if non-existing
+    // Clear existing options
+    medList.innerHTML = '';
+    // Populate options
+    Object.keys(medData).forEach(medName => {
+        const option = document.createElement('option');
+        option.value = medName;
+        medList.appendChild(option);
+    });
+}
+
+
 // ---SetTypeList---
 // Set datalist of med(Type) based on medName
 function setTypeList(element) {
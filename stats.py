@@ -0,0 +1,176 @@
+import re
+from collections import Counter
+
+from sqlalchemy import text
+
+
+# Per doctor summary tables, kept up to date by the prescription write paths
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS stats_months (
+        user_id INTEGER NOT NULL,
+        month TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY(user_id, month),
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )""",
+    """CREATE TABLE IF NOT EXISTS stats_medications (
+        user_id INTEGER NOT NULL,
+        med_name TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY(user_id, med_name),
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )""",
+    """CREATE TABLE IF NOT EXISTS stats_terms (
+        user_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        term TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY(user_id, kind, term),
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )""",
+    # Top-N straight from the index, no sorting
+    "CREATE INDEX IF NOT EXISTS stats_medications_top ON stats_medications (user_id, count)",
+    "CREATE INDEX IF NOT EXISTS stats_terms_top ON stats_terms (user_id, kind, count)",
+]
+
+# vitals column: stats_terms kind
+TERMS = {"diagnosis": "diagnosis", "chief_complaints": "complaint"}
+
+
+def terms(value):
+    """Distinct lowercase terms of a free text field (comma, semicolon or line separated)"""
+    return {term for term in (part.strip().lower() for part in re.split(r"[,;\n]+", value or "")) if term}
+
+
+def _upsert(conn, months, names, kinds):
+    # Add {(user_id, month): n}, {(user_id, med_name): n} and {(user_id, kind, term): n} counts to the summary tables
+    if months:
+        conn.execute(
+            text("""INSERT INTO stats_months(user_id, month, count) VALUES (:uid, :month, :count)
+                ON CONFLICT(user_id, month) DO UPDATE SET count = stats_months.count + excluded.count"""),
+            [{"uid": uid, "month": month, "count": count} for (uid, month), count in months.items()]
+        )
+    if names:
+        conn.execute(
+            text("""INSERT INTO stats_medications(user_id, med_name, count) VALUES (:uid, :name, :count)
+                ON CONFLICT(user_id, med_name) DO UPDATE SET count = stats_medications.count + excluded.count"""),
+            [{"uid": uid, "name": name, "count": count} for (uid, name), count in names.items()]
+        )
+    if kinds:
+        conn.execute(
+            text("""INSERT INTO stats_terms(user_id, kind, term, count) VALUES (:uid, :kind, :term, :count)
+                ON CONFLICT(user_id, kind, term) DO UPDATE SET count = stats_terms.count + excluded.count"""),
+            [{"uid": uid, "kind": kind, "term": term, "count": count} for (uid, kind, term), count in kinds.items()]
+        )
+
+
+def record(conn, user_id, prescriptions, delta=1):
+    """Add (or with delta=-1 remove) prescriptions [(month, medications, vital),...] to the doctor's statistics
+
+    month is the 'YYYY-MM' of the visit date, None leaves the monthly counts alone.
+    """
+    months, names, kinds = Counter(), Counter(), Counter()
+    for month, medications, vital in prescriptions:
+        if month:
+            months[month] += delta
+        # A medication listed twice counts once
+        names.update({med["med_name"]: delta for med in medications if med.get("med_name")})
+        for column, kind in TERMS.items():
+            kinds.update({(kind, term): delta for term in terms(vital.get(column))})
+
+    _upsert(
+        conn,
+        {(user_id, month): count for month, count in months.items()},
+        {(user_id, name): count for name, count in names.items()},
+        {(user_id, kind, term): count for (kind, term), count in kinds.items()},
+    )
+
+    # Drop what nobody prescribes anymore
+    if delta < 0:
+        for table in ["stats_months", "stats_medications", "stats_terms"]:
+            conn.execute(text(f"DELETE FROM {table} WHERE user_id = :uid AND count <= 0"), {"uid": user_id})
+
+
+def load(conn, user_id, months=24, top=10):
+    """Get {"months": [(month, count),...] newest first, "medications"/"diagnosis"/"complaint": [(name, count),...] most frequent first}"""
+    params = {"uid": user_id, "months": months, "top": top}
+    summary = {
+        "months": conn.execute(
+            text("SELECT month, count FROM stats_months WHERE user_id = :uid ORDER BY month DESC LIMIT :months"), params
+        ).all(),
+        "medications": conn.execute(
+            text("SELECT med_name, count FROM stats_medications WHERE user_id = :uid ORDER BY count DESC LIMIT :top"), params
+        ).all(),
+    }
+    for kind in TERMS.values():
+        summary[kind] = conn.execute(
+            text("SELECT term, count FROM stats_terms WHERE user_id = :uid AND kind = :kind ORDER BY count DESC LIMIT :top"),
+            {**params, "kind": kind}
+        ).all()
+    return summary
+
+
+def _terms(conn, where, user_id):
+    # {(user_id, kind, term): prescriptions} of the vitals, terms split in python while streaming the rows
+    counts = Counter()
+    rows = conn.execute(
+        text(f"""SELECT prescriptions.user_id, vitals.chief_complaints, vitals.diagnosis FROM vitals
+            JOIN prescriptions ON prescriptions.id = vitals.prescription_id {where.replace("user_id", "prescriptions.user_id")}""").execution_options(yield_per=1000),
+        {"uid": user_id}
+    )
+    for row in rows.mappings():
+        for column, kind in TERMS.items():
+            for term in terms(row[column]):
+                counts[(row["user_id"], kind, term)] += 1
+    return counts
+
+
+def _archived(archives, years, where, user_id):
+    # Counts of the prescriptions in the year files, same queries as the live ones
+    months, names, kinds = Counter(), Counter(), Counter()
+    for year in years:
+        with archives.engine(year).connect() as conn:
+            for row in conn.execute(
+                text(f"SELECT user_id, substr(visit_date, 1, 7) AS month, COUNT(*) AS count FROM prescriptions {where} GROUP BY user_id, month"),
+                {"uid": user_id}
+            ):
+                months[(row.user_id, row.month)] += row.count
+            for row in conn.execute(
+                text(f"""SELECT user_id, med_name, COUNT(DISTINCT prescription_id) AS count FROM medications
+                    {where} {"AND" if where else "WHERE"} med_name IS NOT NULL AND med_name != '' GROUP BY user_id, med_name"""),
+                {"uid": user_id}
+            ):
+                names[(row.user_id, row.med_name)] += row.count
+            kinds.update(_terms(conn, where, user_id))
+    return months, names, kinds
+
+
+def rebuild(conn, user_id=None, archives=None):
+    """Recompute the statistics from the prescription tables (all doctors if no user_id)
+
+    Archived prescriptions are counted too, read from their year files given the archive.Archive.
+    """
+    where = "WHERE user_id = :uid" if user_id is not None else ""
+    for table in ["stats_months", "stats_medications", "stats_terms"]:
+        conn.execute(text(f"DELETE FROM {table} {where}"), {"uid": user_id})
+
+    # Visit month ('YYYY-MM' prefix of the visit date, as record() takes it)
+    conn.execute(
+        text(f"""INSERT INTO stats_months(user_id, month, count)
+            SELECT user_id, substr(visit_date, 1, 7), COUNT(*) FROM prescriptions {where}
+            GROUP BY user_id, substr(visit_date, 1, 7)"""),
+        {"uid": user_id}
+    )
+    # Prescriptions per medication (a medication listed twice counts once)
+    conn.execute(
+        text(f"""INSERT INTO stats_medications(user_id, med_name, count)
+            SELECT user_id, med_name, COUNT(DISTINCT prescription_id) FROM medications
+            {where} {"AND" if where else "WHERE"} med_name IS NOT NULL AND med_name != ''
+            GROUP BY user_id, med_name"""),
+        {"uid": user_id}
+    )
+    _upsert(conn, {}, {}, _terms(conn, where, user_id))
+
+    if archives:
+        years = conn.execute(text(f"SELECT DISTINCT year FROM archived {where}"), {"uid": user_id}).scalars().all()
+        _upsert(conn, *_archived(archives, years, where, user_id))
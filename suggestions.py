@@ -0,0 +1,136 @@
+from sqlalchemy import bindparam, text
+
+
+# Medication fields that get suggestions on the prescription form
+FIELDS = ["dose", "form", "schedule", "timing", "duration"]
+
+# Table holding per doctor counts of every (med_name, field, value) ever prescribed
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS med_suggestions (
+        user_id INTEGER NOT NULL,
+        med_name TEXT NOT NULL,
+        field TEXT NOT NULL,
+        value TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY(user_id, med_name, field, value),
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )
+"""
+
+
+# Version of each doctor's medication entries, bumped on every change (a row whose
+# medication has no counts left is the tombstone of a removed entry)
+VERSIONS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS med_versions (
+        user_id INTEGER NOT NULL,
+        med_name TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        PRIMARY KEY(user_id, med_name),
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )
+"""
+
+
+def record(conn, user_id, medications, delta=1):
+    """Add (or with delta=-1 remove) medication rows to the doctor's suggestion counts"""
+
+    # One (med_name, field, value) count per field of each medication row
+    params = []
+    for med in medications:
+        if not med.get("med_name"):
+            continue
+        for field in FIELDS:
+            params.append({
+                "uid": user_id,
+                "name": med["med_name"],
+                "field": field,
+                "value": med.get(field) or "",
+                "delta": delta
+            })
+
+    if not params:
+        return
+
+    # PostgreSQL: the doctor's row locked up front, concurrent saves then count and number their
+    # versions one after the other (SQLite transactions here hold the write lock already)
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT id FROM users WHERE id = :uid FOR UPDATE"), {"uid": user_id})
+
+    conn.execute(
+        text("""INSERT INTO med_suggestions(user_id, med_name, field, value, count)
+            VALUES (:uid, :name, :field, :value, :delta)
+            ON CONFLICT(user_id, med_name, field, value) DO UPDATE SET count = med_suggestions.count + excluded.count"""),
+        params
+    )
+
+    # Drop values nobody prescribes anymore
+    if delta < 0:
+        conn.execute(text("DELETE FROM med_suggestions WHERE user_id = :uid AND count <= 0"), {"uid": user_id})
+
+    # New version of the changed entries (the write lock or the doctor's row is held from here to commit)
+    new_version = version(conn, user_id) + 1
+    conn.execute(
+        text("""INSERT INTO med_versions(user_id, med_name, version) VALUES (:uid, :name, :version)
+            ON CONFLICT(user_id, med_name) DO UPDATE SET version = excluded.version"""),
+        [{"uid": user_id, "name": name, "version": new_version} for name in {param["name"] for param in params}]
+    )
+
+
+def version(conn, user_id):
+    """Current version of a doctor's medData (0 before anything was recorded)"""
+    return conn.execute(text("SELECT MAX(version) FROM med_versions WHERE user_id = :uid"), {"uid": user_id}).scalar() or 0
+
+
+def changes(conn, user_id, since):
+    """Get (medData entries changed after version since, names of removed medications)"""
+    names = conn.execute(
+        text("SELECT med_name FROM med_versions WHERE user_id = :uid AND version > :since"),
+        {"uid": user_id, "since": since}
+    ).scalars().all()
+    med_data = load(conn, user_id, names)
+    return med_data, [name for name in names if name not in med_data]
+
+
+def load(conn, user_id, med_names=None):
+    """Get medData in {med_name: {type_data: [Data,...],...},...} structure, frequency-sorted (only med_names if given)"""
+
+    if med_names is None:
+        rows = conn.execute(
+            text("SELECT med_name, field, value FROM med_suggestions WHERE user_id = :uid AND count > 0 ORDER BY med_name, field, count DESC"),
+            {"uid": user_id}
+        ).all()
+    elif not med_names:
+        return {}
+    else:
+        rows = conn.execute(
+            text("""SELECT med_name, field, value FROM med_suggestions WHERE user_id = :uid AND med_name IN :names AND count > 0
+                ORDER BY med_name, field, count DESC""").bindparams(bindparam("names", expanding=True)),
+            {"uid": user_id, "names": list(med_names)}
+        ).all()
+
+    med_data = {}
+    for med_name, field, value in rows:
+        if med_name not in med_data:
+            med_data[med_name] = {f"{type}_data": [] for type in FIELDS}
+        med_data[med_name][f"{field}_data"].append(value)
+    return med_data
+
+
+def rebuild(conn, user_id=None):
+    """Recompute suggestion counts from the medications table (all doctors if no user_id)
+
+    Versions aren't bumped: used only where no client holds a copy yet (migrations, fresh databases).
+    """
+
+    where = "WHERE user_id = :uid" if user_id is not None else ""
+    conn.execute(text(f"DELETE FROM med_suggestions {where}"), {"uid": user_id})
+
+    # One grouped INSERT ... SELECT per field
+    for field in FIELDS:
+        conn.execute(
+            text(f"""INSERT INTO med_suggestions(user_id, med_name, field, value, count)
+                SELECT user_id, med_name, '{field}', COALESCE({field}, ''), COUNT(*) FROM medications
+                {where} {"AND" if where else "WHERE"} med_name IS NOT NULL AND med_name != ''
+                GROUP BY user_id, med_name, COALESCE({field}, '')"""),
+            {"uid": user_id}
+        )
@@ -0,0 +1,31 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app reads its databases from the environment at import time
+FOLDER = tempfile.mkdtemp(prefix="at-tibb-test-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(FOLDER, 'prescriptions.db')}")
+os.environ.setdefault("SESSION_DATABASE", f"sqlite:///{os.path.join(FOLDER, 'sessions.db')}")
+os.environ.setdefault("ARCHIVE_FOLDER", os.path.join(FOLDER, "archive"))
+os.environ.setdefault("SLOW_QUERY_LOG", os.path.join(FOLDER, "slow_queries.log"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def app():
+    from app import app, engine
+    from benchmarks import workload
+
+    # A few synthetic doctors, enough rows for the planner to prefer the indexes
+    with engine.begin() as conn:
+        workload.generate(conn, doctors=2, prescriptions=300, medications=40)
+    return app
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    client.post("/login", data={"username": "doctor1", "password": "bench"})
+    return client
@@ -0,0 +1,107 @@
+"""Concurrent writers on PostgreSQL, where nothing serializes them the way SQLite's write lock does
+
+Runs only with TEST_DATABASE_URL set to a throwaway PostgreSQL database (its public schema is
+dropped), e.g. TEST_DATABASE_URL=postgresql+psycopg://postgres@localhost/at_test python -m pytest
+"""
+import os
+import threading
+
+import pytest
+from sqlalchemy import text
+
+import bulk
+import database
+import fts
+import migrations
+import registry
+import suggestions
+
+URL = os.environ.get("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(not URL, reason="TEST_DATABASE_URL (a throwaway PostgreSQL database) not set")
+
+WRITERS = 8
+
+
+@pytest.fixture(scope="module")
+def engine():
+    engine = database.create(URL, {}, pool_size=WRITERS)
+    with engine.begin() as conn:
+        conn.execute(text("DROP SCHEMA public CASCADE"))
+        conn.execute(text("CREATE SCHEMA public"))
+    migrations.migrate(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def user_id(engine, request):
+    with engine.begin() as conn:
+        return conn.execute(text("INSERT INTO users(username, hash) VALUES (:name, '') RETURNING id"), {"name": request.node.name}).scalar()
+
+
+def concurrently(engine, work):
+    """Results of work(conn, number) run by WRITERS threads at once, each in its own write transaction"""
+    barrier = threading.Barrier(WRITERS)
+    results = [None] * WRITERS
+    errors = []
+
+    def run(number):
+        barrier.wait()
+        try:
+            results[number] = database.write(engine, lambda conn: work(conn, number))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(number,)) for number in range(WRITERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    return results
+
+
+def test_new_patient_registered_once(engine, user_id):
+    ids = concurrently(engine, lambda conn, number: registry.find_or_create(conn, user_id, "Ali  Khan", "male"))
+    assert len(set(ids)) == 1
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM patient_registry WHERE user_id = :uid"), {"uid": user_id}).scalar() == 1
+
+
+def test_med_data_versions_distinct(engine, user_id):
+    def save(conn, number):
+        suggestions.record(conn, user_id, [{"med_name": f"Med {number}", "dose": "500mg"}])
+
+    concurrently(engine, save)
+    with engine.connect() as conn:
+        versions = conn.execute(text("SELECT version FROM med_versions WHERE user_id = :uid"), {"uid": user_id}).scalars().all()
+    assert sorted(versions) == list(range(1, WRITERS + 1))
+
+    # Counted up on a conflict
+    database.write(engine, lambda conn: save(conn, 0))
+    with engine.connect() as conn:
+        count = conn.execute(
+            text("SELECT count FROM med_suggestions WHERE user_id = :uid AND med_name = 'Med 0' AND field = 'dose'"), {"uid": user_id}
+        ).scalar()
+    assert count == 2
+
+
+def test_import_then_save(engine, user_id, request):
+    records = [
+        {"timestamp": f"2024-01-0{day} 10:00:00", "day": day, "month": 1, "year": 2024, "patient": {"patient_name": f"Patient {day}", "sex": "female"},
+         "vitals": {"diagnosis": "viral fever"}, "medications": [{"med_name": "Napa", "dose": "500mg"}]}
+        for day in range(1, 6)
+    ]
+    assert bulk.import_records(engine, records, username=request.node.name) == 5
+
+    # The id sequence moved past the imported ids
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO prescriptions(user_id, visit_date) VALUES (:uid, '2024-02-01')"), {"uid": user_id})
+
+    join, condition, rank, params = fts.search("postgresql", {"patient_name": "pati", "diagnosis": "viral"}, user_id)
+    with engine.connect() as conn:
+        found = conn.execute(
+            text(f"SELECT prescriptions.id FROM prescriptions {join} WHERE {condition} AND prescriptions.user_id = :uid"), {**params, "uid": user_id}
+        ).scalars().all()
+    assert len(found) == 5
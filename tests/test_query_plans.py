@@ -0,0 +1,136 @@
+import os
+import re
+
+import pytest
+from sqlalchemy import event, text
+
+import migrations
+
+
+@pytest.fixture
+def statements(app):
+    """Every statement reading or writing a table while the test makes its requests, with its parameters"""
+    from app import engine
+
+    seen = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")):
+            # (executemany: the plan of the first row's)
+            seen.append((statement, parameters[0] if executemany else parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    yield seen
+    event.remove(engine, "before_cursor_execute", capture)
+
+
+def full_scans(statements):
+    """(statement, plan step) of every full table scan in the plans of statements"""
+    from app import engine
+
+    found = []
+    with engine.connect() as conn:
+        for statement, parameters in statements:
+            for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all():
+                if migrations.full_scan(row[-1]):
+                    found.append((" ".join(statement.split()), row[-1]))
+    return found
+
+
+def test_history(client, statements):
+    response = client.get("/history")
+    assert response.status_code == 200
+    cursor = re.search(rb"cursor=([\w=-]+)", response.data).group(1).decode()
+    # Second page: keyset condition on (visit_date, id)
+    response = client.get(f"/history?cursor={cursor}")
+    assert response.status_code == 200
+    assert statements
+    assert full_scans(statements) == []
+
+
+@pytest.mark.parametrize("form", [
+    {"patient-name": "ali"},
+    {"med_name": "napa"},
+    {"diagnosis": "fever", "date-from": "2018-01-01", "date-to": "2020-12-31"},
+    {"date-from": "2018-01-01"},
+    {"sex": "female"},
+])
+def test_search(client, statements, form):
+    response = client.post("/search", data=form)
+    assert response.status_code == 200
+    if set(form) & {"patient-name", "med_name", "diagnosis"}:
+        # Text filters go through the search_index MATCH
+        assert any("MATCH" in statement for statement, _ in statements)
+    assert full_scans(statements) == []
+
+
+def test_query(app, statements):
+    # A fresh login loads the patient suggestions from the database
+    client = app.test_client()
+    client.post("/login", data={"username": "doctor2", "password": "bench"})
+    for kind, value in [("patient_name", "al"), ("dose", "napa")]:
+        response = client.get(f"/query?value={value}&type={kind}")
+        assert response.status_code == 200
+    assert statements
+    assert full_scans(statements) == []
+
+
+def test_full_scan():
+    assert migrations.full_scan("SCAN prescriptions")
+    assert migrations.full_scan("SCAN search_index VIRTUAL TABLE INDEX 0:")
+    assert not migrations.full_scan("SCAN search_index VIRTUAL TABLE INDEX 0:M7")
+    assert not migrations.full_scan("SEARCH prescriptions USING INDEX prescriptions_visit (user_id=?)")
+    assert not migrations.full_scan("SCAN CONSTANT ROW")
+
+
+FORM = {
+    "patient-name": "Plan Patient", "age": "40", "sex": "male", "day": "3", "month": "4", "year": "2024",
+    "chief-complaints": "fever", "diagnosis": "viral fever",
+    "med_name[]": ["Napa", "Seclo"], "dose[]": ["500mg", "20mg"], "form[]": ["Tab.", "Cap."],
+    "schedule[]": ["1+0+1", "1+0+0"], "timing[]": ["after meal", "before meal"], "duration[]": ["5 days", "14 days"],
+}
+
+
+def test_save_view_edit(client, statements):
+    # Save: registry lookup, statistics and medData counts, full-text index
+    response = client.post("/", data=FORM)
+    assert response.status_code == 302
+    prescription_id = int(response.headers["Location"].split("id=")[1])
+
+    assert client.get(f"/view?id={prescription_id}").status_code == 200
+    assert client.get(f"/edit?id={prescription_id}").status_code == 200
+    # Edit: one medication changed, one removed, one added
+    edited = {**FORM, "patient-name": "Plan Patient Renamed", "day": "5", "month": "6",
+              "med_name[]": ["Napa", "Monas"], "dose[]": ["650mg", "10mg"]}
+    response = client.post(f"/edit?id={prescription_id}", data=edited)
+    assert response.headers["Location"].endswith(f"/view?id={prescription_id}")
+    assert any(statement.lstrip().upper().startswith("UPDATE") for statement, _ in statements)
+    assert full_scans(statements) == []
+
+
+def test_patient_stats_med_data(client, statements):
+    from app import engine
+
+    with engine.connect() as conn:
+        user_id = conn.execute(text("SELECT id FROM users WHERE username = 'doctor1'")).scalar()
+        patient_id = conn.execute(text("SELECT patient_id FROM prescriptions WHERE user_id = :uid AND patient_id IS NOT NULL LIMIT 1"), {"uid": user_id}).scalar()
+        version = conn.execute(text("SELECT MAX(version) FROM med_versions WHERE user_id = :uid"), {"uid": user_id}).scalar()
+    statements.clear()
+
+    assert client.get(f"/patient?id={patient_id}").status_code == 200
+    assert client.get("/stats").status_code == 200
+    response = client.get(f"/med-data?since={version - 5}")
+    assert response.status_code == 200 and response.get_json()["full"] is False
+    assert full_scans(statements) == []
+
+
+def test_literal_statements(app):
+    """flask check-queries on app.py: no literal statement planned as a full table SCAN"""
+    from app import engine
+
+    found = []
+    with engine.connect() as conn:
+        for lineno, sql in migrations.statements(os.path.join(os.path.dirname(os.path.dirname(__file__)), "app.py")):
+            if sql.split()[0].upper() in ("SELECT", "UPDATE", "DELETE", "INSERT", "WITH"):
+                found += [(lineno, detail) for detail in migrations.scans(conn, sql)]
+    assert found == []